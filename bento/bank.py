@@ -27,6 +27,11 @@ class Bank:
     vertical: bool
         Whether this bank should be arranged vertically or not, in which case the
         components will stack and the shape will adjust.
+    executor: string
+        Where the bank's callbacks run: "inline" in the thread serving the request,
+        or "process" in a pool of worker processes forked with the app's data as it
+        starts (see executil.start_pool), for heavy figures that shouldn't hold up
+        the rest.
     kwargs: dict
         Passthrough of additional arguments that might get picked up at other levels.
 
@@ -51,14 +56,18 @@ class Bank:
         vertical=False,
         height=None,
         width=None,
+        executor="inline",
         **kwargs,
     ):
         self.uid = uid
         self.dataid = dataid
+        self.executor = executor
 
         # Just reference the data we actually need
         self.data = g_data[dataid]
         self.df = g_data[dataid]["df"]
+        # Summary of the columns, their uniques and bounds (see datautil.profile_df)
+        self.profile = g_data[dataid]["profile"]
         self.fixed_width = width
         self.fixed_height = height
         self.variant = variant
@@ -76,6 +85,13 @@ class Bank:
         self.callbacks = {}
         self.connectors = {}
 
+    def column_values(self, column):
+        """Sorted unique values of a column, or just its bounds if there are many"""
+        uniques = self.profile["uniques"][column]
+        if uniques is not None:
+            return uniques
+        return np.array([self.profile["min"][column], self.profile["max"][column]])
+
     def create_id(self, name):
         return {"name": name, **self.uid}
 
@@ -125,7 +141,11 @@ class Bank:
         return f"{prefix}__{action}"
 
     def add_callback(self, target_cid, cb_outputs, code):
-        """Adds callback function that can update the component of the bank"""
+        """Adds callback function that can update the component of the bank
+
+        The outputs may include other components of the bank, when one callback
+        updates several of them (the callback is still listed under target_cid).
+        """
 
         # A standard block to handle the inputs to the callback via callback_context
         input_processing = f"""
@@ -135,12 +155,29 @@ class Bank:
             inputs.update({self.kwargs})
         """
         code_blocks = [input_processing, code]
+        name = self.name_callback(target_cid)
 
         self.callbacks[target_cid] = {
             "provides": [val[1] for val in cb_outputs],
-            "name": self.name_callback(target_cid),
+            "outputs": list(cb_outputs),
+            "name": name,
             "code": self.format_code(code_blocks),
         }
+        if self.executor == "process":
+            # The callback context only exists here, so just the inputs are sent on
+            caller = f"""
+                inputs = dictutil.strip_prefix(dash.callback_context.inputs)
+                return executil.run_in_process({name}_body, inputs, data=_global_data)
+            """
+            body_processing = f"""
+                data = _global_data["{self.dataid}"]
+                sdf = data["df"]
+                inputs.update({self.kwargs})
+            """
+            self.callbacks[target_cid]["code"] = self.format_code([caller])
+            self.callbacks[target_cid]["body"] = self.format_code(
+                [body_processing, code]
+            )
 
     def add_internal_callback(self, target_cid, cb_inputs, cb_outputs, code):
         """Adds a callback meant to update intra-bank components"""
@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 
 from bento import Bank
 
@@ -34,12 +35,13 @@ class date_control(Bank):
         super().__init__(**kwargs)
 
         # TODO Incorporate type-checking and autostructure output
-        default = "date" if "date" in self.df.columns else self.data["columns"][0]
+        columns = self.profile["columns"]
+        default = "date" if "date" in columns else self.data["columns"][0]
         column = column or default
 
         # Generate the component calls
         args = dict(
-            options=np.unique(self.df[column]),
+            options=self.column_values(column),
             label=f"Select {column}:",
             variant=variant,
         )
@@ -53,9 +55,8 @@ class date_control(Bank):
         # Increase size to fit the date picker
         block_size = {"ideal": [2, 4], "min": [1, 3]}
 
-        args = dict(
-            options=np.unique(self.df[column].dt.to_pydatetime()), variant=variant
-        )
+        dates = pd.to_datetime(self.column_values(column)).to_pydatetime()
+        args = dict(options=np.unique(dates), variant=variant)
         picker = self.create_component("date_picker", f"{column}_picker", args=args)
         # TODO The code creation needs a better methodology
         if self.variant == "single":
@@ -11,7 +11,14 @@ class graph(Bank):
         a geographical representation will be under the "map" category.
     variant: string
         Each category has a set of variants supported. The default category/variant
-        is represented as "normal.scatter"
+        is represented as "normal.scatter". Both categories have a "raster" variant,
+        which bins dense points into a grid on the server, binning again on zoom.
+    max_points: int
+        The most points drawn for each trace of a scatter graph, beyond which the
+        trace is downsampled on the server (5000 by default, None draws them all).
+    webgl_threshold: int
+        The most points a scatter graph draws as SVG, beyond which all its traces are
+        drawn with WebGL (10000 by default, None always uses SVG).
     kwargs: dict
         Passthrough of additional arguments that might get picked up at other levels
         such as the super() call.
@@ -34,7 +41,13 @@ class graph(Bank):
         else:
             dep_var = "y"
 
-        cb_code = f"""
+        # Rasters are binned again for the view zoomed to, so follow the graph's zoom
+        zoom_code = ""
+        if variant == "raster":
+            zoom_code = """
+            inputs["relayout"] = inputs.pop("graph.relayoutData", None)"""
+
+        cb_code = f"""{zoom_code}
             inputs = dictutil.strip_attr(inputs)
             component_type = f"graph.{category}.{variant}"
             inputs = butil.apply_defaults(component_type, inputs, data)
@@ -43,6 +56,9 @@ class graph(Bank):
             figure = Graph.{category}(sdf,
                 filters=filters,
                 transforms=transforms,
+                cube=data.get("cube"),
+                index=data.get("index"),
+                cache=datautil.frame_cache(data),
                 **inputs)
             figure.update_layout(classes.graph)
 
@@ -55,5 +71,9 @@ class graph(Bank):
         # Generate the component calls
         graph = self.create_component("graph", name="graph", args={})
         cb_outputs = [(graph.uid, "figure"), (graph.uid, "style")]
-        self.add_callback(graph.uid, cb_outputs, cb_code)
+        if variant == "raster":
+            cb_inputs = {(graph.uid, "relayoutData")}
+            self.add_internal_callback(graph.uid, cb_inputs, cb_outputs, cb_code)
+        else:
+            self.add_callback(graph.uid, cb_outputs, cb_code)
         self.align(block_size)
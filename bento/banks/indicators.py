@@ -20,6 +20,7 @@ class indicators(Bank):
         block_size = {"ideal": [2, 1.5], "min": [1, 1]}
         super().__init__(**kwargs)
 
+        indicators = []
         for ind_comp in components:
             name = ind_comp.get("name", ind_comp["args"]["y_column"])
             args = {
@@ -29,20 +30,33 @@ class indicators(Bank):
             indicator = self.create_component(
                 "indicator", f"{name}_indicator", args=args
             )
-
-            callback_code = f"""
-                inputs = dictutil.strip_attr(inputs)
-                filters = butil.prepare_filters(inputs)
-                sig, scale = butil.aggregate(
-                    sdf,
-                    filters=filters,
-                    **{ind_comp['args']}
-                    )
+            indicators.append((indicator.uid, ind_comp))
+
+        # One callback updates every indicator, from a single pass over the data.
+        # Dash gets the outputs sorted, so the values are returned in that order.
+        indicators.sort(key=lambda item: item[0])
+        specs = [ind_comp["args"] for _, ind_comp in indicators]
+        units = [ind_comp.get("unit", "") for _, ind_comp in indicators]
+        callback_code = f"""
+            inputs = dictutil.strip_attr(inputs)
+            filters = butil.prepare_filters(inputs)
+            results = butil.aggregate_many(
+                sdf,
+                {specs},
+                filters=filters,
+                cube=data.get("cube"),
+                index=data.get("index"),
+                cache=datautil.frame_cache(data),
+                )
+            values = []
+            for (sig, scale), unit in zip(results, {units}):
                 sig = f'{{float(f"{{sig:.3g}}"):g}}'
-                return f"{{sig}} {{scale}}{ind_comp.get("unit", "")}"
-                """
+                values.append(f"{{sig}} {{scale}}{{unit}}")
+            return values if len(values) > 1 else values[0]
+            """
 
-            cb_outputs = [(indicator.uid, "children")]
-            self.add_callback(indicator.uid, cb_outputs, callback_code)
+        cb_outputs = [(uid, "children") for uid, _ in indicators]
+        if cb_outputs:
+            self.add_callback(cb_outputs[0][0], cb_outputs, callback_code)
 
         self.align(block_size)
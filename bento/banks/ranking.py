@@ -40,7 +40,6 @@ class ranking(Bank):
         cb_code = f"""
             inputs = dictutil.strip_attr(inputs)
             filters = butil.prepare_filters(inputs)
-            fdf = butil.filter_df(sdf, filters=filters)
 
             column = dictutil.extract_unique("_column", inputs)
             geo = dictutil.extract_unique("geo", inputs)
@@ -50,7 +49,15 @@ class ranking(Bank):
             children = [
                 html.H4(f"Top in {{inputs['column'].title()}}", style=classes.h4)
                 ]
-            for item in butil.rank(fdf, **inputs):
+            for item in butil.rank(
+                sdf,
+                filters=filters,
+                cube=data.get("cube"),
+                index=data.get("index"),
+                totals=datautil.group_totals(data),
+                cache=datautil.frame_cache(data),
+                **inputs,
+            ):
                 text = [
                   html.Span(f"{{item[1]:{nformat}}}", style=classes.rank_value),
                   html.Span(f"      {{item[0]}}")
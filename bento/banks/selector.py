@@ -35,8 +35,12 @@ class selector(Bank):
         # (e.g. a util function or a class method of option_set)
         for col in columns:
             option_args = dictutil.extract_path(f"{col}.", kwargs)
-            option_vals = pd.Series(sorted(self.df[col].unique()))
-            options_numeric = np.issubdtype(option_vals, np.number)
+            option_vals = pd.Series(self.column_values(col))
+            options_numeric = np.issubdtype(option_vals.dtype, np.number)
+            # Too many values to list in the app code, so they're filled in at load
+            overflowed = self.profile["uniques"][col] is None and not options_numeric
+            if overflowed:
+                option_vals = pd.Series([], dtype=object)
             options = {
                 "options": list(option_vals),
                 "overflow": f"""
@@ -54,7 +58,7 @@ class selector(Bank):
                 "RadioItems.labelStyle": {"display": "block"},
                 "Checklist.labelStyle": {"display": "block"},
             }
-            if len(options["options"]) <= 3:  # Use a list for few options
+            if len(options["options"]) <= 3 and not overflowed:  # List few options
                 comp_type = "selection_list"
             elif options_numeric:  # If there are numerics, use a slider
                 comp_type = "slider"
@@ -3,6 +3,7 @@
 import black
 import cerberus
 import copy
+import functools
 import importlib
 import pathlib
 import re
@@ -12,7 +13,7 @@ from jinja2 import Environment, PackageLoader
 from bento import util as butil
 from bento import banks, grid, schema, style
 
-from bento.common import logger, logutil, dictutil, codeutil  # noqa
+from bento.common import logger, logutil, dictutil, codeutil, datautil  # noqa
 
 logging = logger.fancy_logger(__name__, fmt="simple")
 
@@ -189,18 +190,41 @@ class Bento:
         return desc
 
     def process_data(self, descriptor: Dict) -> Dict:
+        """Loads each dataset, or just its profile, to inform the banks
+
+        Banks only need the columns, types, unique values and bounds of the data,
+        which are kept in data[dataid]["profile"]. A data entry with "profile"
+        set asks the loader for only that summary (see datautil.profile_df), so
+        the full DataFrame is never loaded to build the app.
+        """
         logging.info("Loading the dataframes specified:")
-        data = {}
+        loaders = {}
         for dataid, entry in descriptor["data"].items():
-            logging.info(f"  {dataid}:")
             try:
                 data_module = importlib.import_module(entry["module"])
             except ImportError:
                 logging.warning(f"Failed to load {entry['module']}")
                 continue
-            data[dataid] = getattr(data_module, entry["call"])(**entry["args"])
+            args = entry["args"]
+            if entry.get("profile"):
+                args = {**args, "profile": True}
+            call = getattr(data_module, entry["call"])
+            loaders[dataid] = functools.partial(call, **args)
+
+        # The datasets are loaded concurrently, see datautil.load_datasets
+        data = datautil.load_datasets(loaders, workers=descriptor.get("load_workers"))
+        for dataid, entry in descriptor["data"].items():
+            if dataid not in data:
+                continue
             data[dataid]["columns"] = list(data[dataid]["types"].keys())
-            logging.info(f"    Loaded Dataframe of shape {data[dataid]['df'].shape}")
+            profile = datautil.profile_df(data[dataid]["df"])
+            data[dataid]["profile"] = profile
+            shape = (profile["rows"], len(profile["columns"]))
+            if entry.get("profile"):
+                data[dataid]["df"] = None
+                logging.info(f"  {dataid}: profiled Dataframe of shape {shape}")
+            else:
+                logging.info(f"  {dataid}: loaded Dataframe of shape {shape}")
         return data
 
     def init_structure(self):
@@ -245,6 +269,8 @@ class Bento:
             "appbar": self.desc.get("appbar", {}),
             "show_help": self.desc.get("show_help", False),
             "data": self.desc["data"],
+            "load_workers": self.desc.get("load_workers"),
+            "process_pool": False,
             "pages": {},
             "banks": {},
             "connectors": connectors,
@@ -266,6 +292,8 @@ class Bento:
             self.context["banks"][bankid] = bank.layout
             self.context["callbacks"].update(bank.callbacks)
             self.context["connectors"].update(bank.connectors)
+            if bank.executor == "process":
+                self.context["process_pool"] = True
 
         # Defines the layout of the page
         self.context["pages"][pageid] = grid.apply_grid(page)
@@ -292,14 +320,13 @@ class Bento:
         for source_bankid, sink_set in connections.items():
             for sink_regex in sink_set:
                 for sink_cid, cb_def in self.context["callbacks"].items():
-                    if not re.search(sink_regex, sink_cid):
+                    outputs = self._callback_outputs(sink_cid, cb_def)
+                    if not any(re.search(sink_regex, cid) for cid, _ in outputs):
                         continue
                     # Make sure we have a connector in place
                     if sink_cid not in self.context["connectors"]:
-                        # The callback defines what component properties it provides
-                        sink_vals = cb_def["provides"]
                         self.context["connectors"][sink_cid] = {
-                            "outputs": [(sink_cid, val) for val in sink_vals],
+                            "outputs": outputs,
                             "inputs": set(),
                         }
                     # Add any connected inputs
@@ -312,15 +339,21 @@ class Bento:
         # Ensure each callback can trigger, even if nothing feeds it
         for sink_cid, cb_def in self.context["callbacks"].items():
             if sink_cid not in self.context["connectors"]:
-                # The callback defines what component properties it provides
-                sink_vals = cb_def.get("provides")
-                if not sink_vals:
+                outputs = self._callback_outputs(sink_cid, cb_def)
+                if not outputs:
                     continue
                 self.context["connectors"][sink_cid] = {
-                    "outputs": [(sink_cid, val) for val in sink_vals],
+                    "outputs": outputs,
                     "inputs": {("location", "pathname")},
                 }
 
+    @staticmethod
+    def _callback_outputs(sink_cid, cb_def):
+        """The component properties a callback provides, as (cid, property) pairs"""
+        if cb_def.get("outputs"):
+            return list(cb_def["outputs"])
+        return [(sink_cid, val) for val in cb_def.get("provides") or []]
+
     def write(self, app_output: str = "bento_app.py", css_folder: str = "assets"):
         """Creates all of the standard Bento output files.
 
@@ -1,14 +1,51 @@
 """This is a collection of utilities related to loading data from file
 """
+import copy
+import glob
+import hashlib
+import io
+import itertools
+import json
+import numpy as np
+import os
 import pandas as pd
 import pathlib
 import pkgutil
+import shutil
+import threading
+import time
+from concurrent import futures
 from fuzzywuzzy import fuzz
 
 from bento.common import util, logger
 
 logging = logger.fancy_logger(__name__)
 
+# NOTE Assembling frames from blocks is what allows zero-copy memory-mapped loads
+# These are pandas internals, so read_columns copies the columns without them
+try:
+    from pandas.core.internals import BlockManager
+    from pandas.core.internals.api import make_block
+except ImportError:
+    logging.warning(f"pandas {pd.__version__} can't assemble frames from blocks")
+    BlockManager = make_block = None
+
+# Binary copies of parsed source files are kept in this folder, next to the source
+CACHE_DIR = ".bento_cache"
+# Bump this when the layout written by write_columns changes
+CACHE_VERSION = 2
+
+# Columns with more distinct values than this only keep their bounds in a profile
+UNIQUE_CAP = 10000
+# Number of rows held in memory at once when profiling a file
+PROFILE_CHUNK_ROWS = 100000
+
+# Text columns with at most this fraction of distinct values become categoricals
+CATEGORY_RATIO = 0.5
+
+# Megabytes of filtered frames each dataset keeps for reuse (see FrameCache)
+FRAME_CACHE_MB = 256
+
 
 def clean_string_name(item):
     return item.strip().replace("*,()", "")
@@ -30,29 +67,1108 @@ def fuzzy_search(name, corpus, clean=clean_string_name):
     return output
 
 
-def df_loader(filename, package="bento", parse_dates=None, location="."):
-    args = {
-        "parse_dates": parse_dates or [],
-        "infer_datetime_format": True,
-    }
+def find_file(filename, package="bento", location="."):
+    """Returns the path of the first match for filename in the search locations"""
     # First try locally for an override file, then check assets
     init_py_path = pkgutil.get_loader(package).path
     package_path = pathlib.Path(init_py_path).parent
     location_list = [location, "assets", f"{package_path}/assets"]
     for loc in location_list:
+        logging.debug(f"Searching for {filename} at {loc}")
+        path = pathlib.Path(f"{loc}/{filename}")
+        if path.is_file():
+            return path
+
+    logging.warning(f"Unable to find {filename} in any of {location_list}")
+
+
+def cache_location(path, args):
+    """Names the cache entry for a source file, keyed on its state and load args
+
+    The entry is named {source}.{state}.{key}, where the state marks the size and
+    modification time of the source, so prune_cache can tell which entries are out
+    of date without reading them.
+    """
+    stat = path.stat()
+    state = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    key_info = [CACHE_VERSION, str(path.resolve()), args]
+    key_str = json.dumps(key_info, sort_keys=True, default=str)
+    key = hashlib.md5(key_str.encode()).hexdigest()[:16]
+    return path.parent / CACHE_DIR / f"{path.name}.{state}.{key}"
+
+
+def _tmp_path(path):
+    """Names a scratch location for path, unique to this process and thread"""
+    return path.with_name(f"{path.name}.tmp{os.getpid()}-{threading.get_ident()}")
+
+
+def write_columns(df, directory):
+    """Stores a DataFrame as a directory of .npy files
+
+    Columns sharing a numeric/datetime dtype are stacked into one 2-d array, which
+    is the layout pandas uses internally. This lets read_columns memory-map the
+    arrays into a frame without pandas ever needing to copy (consolidate) them.
+    The write happens in a temporary directory that is renamed into place, so
+    concurrent readers only ever see a complete entry.
+    """
+    directory = pathlib.Path(directory)
+    tmp_dir = _tmp_path(directory)
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    # Group column positions by how they will be stored
+    groups = {}
+    for loc, (name, series) in enumerate(df.items()):
+        dtype = series.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            groups[("category", loc)] = [loc]
+        elif isinstance(dtype, np.dtype) and dtype.kind in "biufcmM":
+            groups.setdefault(("array", dtype.str), []).append(loc)
+        else:
+            groups.setdefault(("object", ""), []).append(loc)
+
+    meta = {"rows": len(df), "columns": list(df.columns), "blocks": []}
+    try:
+        for idx, ((kind, _), locs) in enumerate(groups.items()):
+            if kind == "category":
+                series = df.iloc[:, locs[0]]
+                np.save(tmp_dir / f"{idx}.npy", series.cat.codes.to_numpy())
+                categories = series.cat.categories.to_numpy()
+                np.save(tmp_dir / f"{idx}.cat.npy", categories, allow_pickle=True)
+            elif kind == "array":
+                values = np.vstack([df.iloc[:, loc].to_numpy() for loc in locs])
+                np.save(tmp_dir / f"{idx}.npy", values)
+            else:
+                values = np.vstack(
+                    [df.iloc[:, loc].to_numpy(dtype=object) for loc in locs]
+                )
+                np.save(tmp_dir / f"{idx}.npy", values, allow_pickle=True)
+            meta["blocks"].append({"kind": kind, "locs": locs})
+        with open(tmp_dir / "meta.json", "w") as fh:
+            json.dump(meta, fh)
+        tmp_dir.rename(directory)
+    finally:
+        # Either the rename succeeded, or another process already wrote the entry
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_columns(directory, mmap=False):
+    """Loads a DataFrame stored by write_columns
+
+    With mmap, numeric, datetime and categorical columns are read-only views onto
+    the files, so every process attaching the same entry shares one copy in the
+    OS page cache. Object columns are always loaded into private memory. The views
+    rely on pandas internals, so where those aren't available the columns are
+    copied into a plain DataFrame instead.
+    """
+    directory = pathlib.Path(directory)
+    with open(directory / "meta.json") as fh:
+        meta = json.load(fh)
+    mmap_mode = "r" if mmap else None
+    blocks = []
+    for idx, block_info in enumerate(meta["blocks"]):
+        kind, locs = block_info["kind"], block_info["locs"]
+        if kind == "category":
+            codes = np.load(directory / f"{idx}.npy", mmap_mode=mmap_mode)
+            categories = np.load(directory / f"{idx}.cat.npy", allow_pickle=True)
+            values = pd.Categorical.from_codes(codes, categories)
+        elif kind == "array":
+            values = np.load(directory / f"{idx}.npy", mmap_mode=mmap_mode)
+        else:
+            values = np.load(directory / f"{idx}.npy", allow_pickle=True)
+        blocks.append((kind, locs, values))
+
+    if BlockManager is not None:
+        try:
+            return _from_blocks(blocks, meta)
+        except (TypeError, ValueError) as exc:
+            logging.warning(f"Copying the columns of {directory.name}: {exc}")
+    columns = {}
+    for kind, locs, values in blocks:
+        for pos, loc in enumerate(locs):
+            columns[loc] = values if kind == "category" else values[pos]
+    df = pd.DataFrame({loc: columns[loc] for loc in sorted(columns)})
+    df.columns = pd.Index(meta["columns"])
+    return df
+
+
+def _from_blocks(blocks, meta):
+    """Assembles the blocks read by read_columns into a frame, without copying"""
+    managed = []
+    for kind, locs, values in blocks:
+        ndim = 2 if kind == "category" else None
+        managed.append(make_block(values, placement=locs, ndim=ndim))
+    axes = [pd.Index(meta["columns"]), pd.RangeIndex(meta["rows"])]
+    return pd.DataFrame(BlockManager(managed, axes))
+
+
+def prune_cache(directory):
+    """Removes cache entries made from an earlier state of the same source file
+
+    Entries for the current state of the source, whatever their load args, are
+    kept (see cache_location). So are partitioned entries, as a Partitions object
+    reads its directory for as long as it's in use, however the source changes.
+    """
+    directory = pathlib.Path(directory)
+    source, state, _ = directory.name.rsplit(".", 2)
+    for entry in directory.parent.glob(f"{glob.escape(source)}.*"):
+        entry_state = entry.name[len(source) + 1 :].split(".", 1)[0]
+        if entry_state == state or ".tmp" in entry.name:
+            continue
+        if (entry / "profile.json").is_file():
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink()
+
+
+def _common_dtype(dtype_a, dtype_b):
+    if dtype_a == dtype_b:
+        return dtype_a
+    try:
+        return str(np.result_type(np.dtype(dtype_a), np.dtype(dtype_b)))
+    except TypeError:
+        return "object"
+
+
+def _restore_values(values, dtype):
+    """Converts a list of plain values back to an array of the given dtype"""
+    if "datetime" in dtype:
+        return pd.to_datetime(values).to_numpy()
+    if dtype == "category" or not pd.api.types.is_numeric_dtype(dtype):
+        return np.array(values, dtype=object)
+    return np.array(values, dtype=dtype)
+
+
+def _plain_value(value):
+    """Converts a value to a type that can be written as JSON"""
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(pd.Timestamp(value))
+    return value.item() if hasattr(value, "item") else value
+
+
+def _finish_profile(profile):
+    """Normalizes the types of the uniques and bounds, sorting the uniques"""
+    for column, dtype in profile["dtypes"].items():
+        uniques = profile["uniques"][column]
+        if uniques is not None:
+            uniques = _restore_values(list(uniques), dtype)
+            try:
+                uniques = np.sort(uniques)
+            except TypeError:
+                logging.debug(f"Can't sort the unique values of {column}")
+            profile["uniques"][column] = uniques
+        for bound in ("min", "max"):
+            value = profile[bound][column]
+            if value is not None:
+                profile[bound][column] = _restore_values([value], dtype)[0]
+    return profile
+
+
+def profile_df(idf, cap=UNIQUE_CAP):
+    """Summarizes a DataFrame with just what Bento needs to build a dashboard
+
+    The profile holds the row count, column names and dtypes, the sorted unique
+    values of each column (None when there are more than cap of them) and the
+    minimum and maximum of each column. A profile passes through unchanged, and
+    the stand-ins for a DataFrame (Partitions, sqlutil.SqlTable) supply their own.
+    """
+    if isinstance(idf, dict):
+        return idf
+    if not isinstance(idf, pd.DataFrame):
+        return idf.profile
+    profile = {
+        "rows": len(idf),
+        "columns": list(idf.columns),
+        "dtypes": {},
+        "uniques": {},
+        "min": {},
+        "max": {},
+    }
+    for column, series in idf.items():
+        dtype = series.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtype = dtype.categories.dtype
+        profile["dtypes"][column] = str(dtype)
+        uniques = pd.unique(series.dropna().to_numpy())
+        profile["uniques"][column] = uniques if len(uniques) <= cap else None
+        try:
+            minimum, maximum = series.min(), series.max()
+        except TypeError:
+            minimum, maximum = None, None
+        profile["min"][column] = None if pd.isnull(minimum) else minimum
+        profile["max"][column] = None if pd.isnull(maximum) else maximum
+    return _finish_profile(profile)
+
+
+def merge_profiles(profile_a, profile_b, cap=UNIQUE_CAP):
+    """Combines the profiles of two DataFrames with the same columns"""
+    merged = {
+        "rows": profile_a["rows"] + profile_b["rows"],
+        "columns": profile_a["columns"],
+        "dtypes": {},
+        "uniques": {},
+        "min": {},
+        "max": {},
+    }
+    for column in profile_a["columns"]:
+        dtype_a, dtype_b = profile_a["dtypes"][column], profile_b["dtypes"][column]
+        merged["dtypes"][column] = _common_dtype(dtype_a, dtype_b)
+
+        uniques = None
+        uniques_a = profile_a["uniques"][column]
+        uniques_b = profile_b["uniques"][column]
+        if uniques_a is not None and uniques_b is not None:
+            uniques = pd.unique(np.concatenate([uniques_a.astype(object), uniques_b]))
+            uniques = uniques if len(uniques) <= cap else None
+        merged["uniques"][column] = uniques
+
+        for bound, func in (("min", min), ("max", max)):
+            values = [profile[bound][column] for profile in (profile_a, profile_b)]
+            values = [value for value in values if value is not None]
+            merged[bound][column] = func(values) if values else None
+    return _finish_profile(merged)
+
+
+def write_profile(profile, path):
+    output = {**profile, "uniques": {}, "min": {}, "max": {}}
+    for column in profile["columns"]:
+        uniques = profile["uniques"][column]
+        if uniques is not None:
+            uniques = [_plain_value(value) for value in uniques]
+        output["uniques"][column] = uniques
+        for bound in ("min", "max"):
+            output[bound][column] = _plain_value(profile[bound][column])
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "w") as fh:
+        json.dump(output, fh)
+    tmp_path.rename(path)
+
+
+def read_profile(path):
+    with open(path) as fh:
+        return _finish_profile(json.load(fh))
+
+
+def profile_csv(path, args, cap=UNIQUE_CAP, chunksize=PROFILE_CHUNK_ROWS, regions=None):
+    """Profiles a CSV file in a streaming pass, holding one chunk at a time"""
+    profile = None
+    for chunk in pd.read_csv(path, chunksize=chunksize, **args):
+        if regions:
+            chunk = add_regions(chunk, regions)
+        chunk_profile = profile_df(chunk, cap=cap)
+        if profile is None:
+            profile = chunk_profile
+        else:
+            profile = merge_profiles(profile, chunk_profile, cap=cap)
+    return profile
+
+
+def _load_profile(path, args, cache_path, cache, regions=None):
+    profile_path = cache_path.with_name(f"{cache_path.name}.profile.json")
+    if profile_path.is_file():
+        try:
+            return read_profile(profile_path)
+        except Exception as exc:
+            logging.warning(f"Ignoring unreadable profile {profile_path}: {exc}")
+
+    # The parsed columns are much cheaper to scan than the CSV, if already cached
+    if cache_path.is_dir():
+        profile = profile_df(read_columns(cache_path, mmap=True))
+    else:
+        profile = profile_csv(path, args, regions=regions)
+
+    if cache:
+        try:
+            profile_path.parent.mkdir(parents=True, exist_ok=True)
+            write_profile(profile, profile_path)
+            prune_cache(cache_path)
+        except OSError as exc:
+            logging.debug(f"Unable to cache the profile at {profile_path}: {exc}")
+    return profile
+
+
+class Partitions:
+    """A dataset stored on disk as a sequence of column-cache partitions
+
+    This stands in for a DataFrame too large to hold in memory. Iterating yields
+    each partition as a memory-mapped DataFrame, indexed by its row positions in
+    the full dataset, so a computation run partition by partition only needs
+    memory for one of them plus its partial results. The bento.util functions
+    that filter and aggregate the data accept a Partitions object directly.
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.paths = sorted(self.directory.glob("part-*"))
+        self.profile = read_profile(self.directory / "profile.json")
+        # Matches DataFrame.attrs, where df_loader notes the source (see refresh)
+        self.attrs = {}
+
+    def __iter__(self):
+        start = 0
+        for path in self.paths:
+            part = read_columns(path, mmap=True)
+            part.index = pd.RangeIndex(start, start + len(part))
+            if "sorted" in self.attrs:
+                part.attrs["sorted"] = self.attrs["sorted"]
+            start += len(part)
+            yield part
+
+    def __len__(self):
+        return self.profile["rows"]
+
+    def __getitem__(self, key):
+        """Supports selecting a single column or slicing the leading rows"""
+        if isinstance(key, slice):
+            return self.head(key.stop)
+        return pd.concat([part[key] for part in self])
+
+    @property
+    def columns(self):
+        return pd.Index(self.profile["columns"])
+
+    @property
+    def shape(self):
+        return (self.profile["rows"], len(self.profile["columns"]))
+
+    def head(self, rows=5):
+        parts = []
+        for part in self:
+            parts.append(part.iloc[:rows])
+            rows -= len(parts[-1])
+            if rows <= 0:
+                break
+        return pd.concat(parts)
+
+    def append(self, df, name):
+        """Returns a new Partitions with df stored as an extra partition
+
+        Entries are shared between processes, so the partition is named for its
+        content by the caller, and one already written by another process is reused.
+        """
+        path = self.directory / f"part-{name}"
+        try:
+            write_columns(df, path)
+        except OSError:
+            if not path.is_dir():
+                raise
+        parts = copy.copy(self)
+        parts.paths = self.paths + [path]
+        parts.profile = merge_profiles(self.profile, profile_df(df))
+        parts.attrs = dict(self.attrs)
+        return parts
+
+
+def _rollup(frames, columns):
+    """Sums the numeric columns of the frames over the groups of columns"""
+    partials = [
+        frame.groupby(columns, observed=True).sum(numeric_only=True)
+        for frame in frames
+    ]
+    rollup = partials[0]
+    if len(partials) > 1:
+        rollup = pd.concat(partials).groupby(level=columns, observed=True).sum()
+    return rollup.reset_index()
+
+
+class Cube:
+    """Sums of the numeric columns of a dataset, rolled up over grouping sets
+
+    Each grouping set is a list of columns (usually keys and dates), and its rollup
+    has a row for each combination of their values, summing the other numeric
+    columns. Filtering and grouping by only those columns, then summing, gives the
+    same result from a rollup as from the full data, while scanning far fewer rows.
+    """
+
+    def __init__(self, idf, grouping_sets):
+        # Partitions are rolled up one at a time, then combined
+        frames = idf if isinstance(idf, Partitions) else [idf]
+        self.rollups = {}
+        for columns in grouping_sets:
+            columns = list(columns)
+            logging.debug(f"Rolling up the data over {columns}")
+            self.rollups[tuple(columns)] = _rollup(frames, columns)
+
+    def lookup(self, columns, grouped=()):
+        """Returns the smallest rollup with all of the columns, if there is one
+
+        The grouped columns must be among those of its grouping set, rather than
+        summed, e.g. those the data is filtered on.
+        """
+        columns = set(columns) | set(grouped)
+        matches = [
+            rollup
+            for grouping, rollup in self.rollups.items()
+            if columns.issubset(rollup.columns) and set(grouped).issubset(grouping)
+        ]
+        return min(matches, key=len) if matches else None
+
+    def append(self, rows):
+        """Returns a new Cube that also includes the rows"""
+        cube = copy.copy(self)
+        cube.rollups = {
+            columns: _rollup([rollup, rows], list(columns))
+            for columns, rollup in self.rollups.items()
+        }
+        return cube
+
+
+def add_cube(data, grouping_sets=True):
+    """Builds a Cube of a dataset, stored in its data entry as data["cube"]
+
+    By default (True), the grouping sets are each combination of the keys, with
+    and without the date columns, along with the date columns alone.
+    """
+    df = data["df"]
+    if not isinstance(df, (pd.DataFrame, Partitions)):
+        logging.warning(f"Unable to build a cube for data of type {type(df)}")
+        return
+    if grouping_sets is True:
+        dtypes = df.profile["dtypes"] if isinstance(df, Partitions) else df.dtypes
+        dates = [col for col, dtype in dict(dtypes).items() if "date" in str(dtype)]
+        keys = [key for key in data.get("keys", []) if key in df.columns]
+        grouping_sets = [dates] if dates else []
+        for size in range(1, len(keys) + 1):
+            for combo in itertools.combinations(keys, size):
+                grouping_sets.append(list(combo))
+                if dates:
+                    grouping_sets.append(list(combo) + dates)
+    start = time.time()
+    data["cube"] = Cube(df, grouping_sets)
+    elapsed = time.time() - start
+    logging.info(f"Built a cube of {len(grouping_sets)} rollups in {elapsed:.2f}s")
+
+
+class InvertedIndex:
+    """Maps each value of some columns to the positions of the rows holding it
+
+    The positions are sorted integer arrays, so the rows matching a set of values
+    (or the intersection over several columns) can be gathered with a single take,
+    touching only those rows rather than scanning the columns. The index is only
+    valid for the frame it was built from, which has rows rows.
+    """
+
+    def __init__(self, idf, columns):
+        self.rows = len(idf)
+        self.dtype = np.int32 if self.rows < 2 ** 31 else np.int64
+        self.positions = {column: self._invert(idf[column]) for column in columns}
+
+    def _invert(self, series, offset=0):
+        groups = series.groupby(series, observed=True, sort=False).indices
+        return {
+            value: (positions + offset).astype(self.dtype)
+            for value, positions in groups.items()
+        }
+
+    def lookup(self, column, values):
+        """Positions of the rows with any of the values in the column"""
+        positions = self.positions[column]
+        arrays = [positions[value] for value in values if value in positions]
+        if not arrays:
+            return np.array([], dtype=self.dtype)
+        if len(arrays) == 1:
+            return arrays[0]
+        # The arrays of different values never overlap
+        return np.sort(np.concatenate(arrays))
+
+    def select(self, selections):
+        """Positions of the rows matching every (column, values) selection"""
+        result = None
+        for column, values in selections:
+            positions = self.lookup(column, values)
+            if result is None:
+                result = positions
+            else:
+                result = np.intersect1d(result, positions, assume_unique=True)
+        return result
+
+    def append(self, rows):
+        """Returns a new index that also covers rows, appended to the frame"""
+        index = copy.copy(self)
+        index.rows = self.rows + len(rows)
+        index.positions = {}
+        for column, positions in self.positions.items():
+            positions = dict(positions)
+            for value, new in self._invert(rows[column], self.rows).items():
+                if value in positions:
+                    new = np.concatenate([positions[value], new])
+                positions[value] = new
+            index.positions[column] = positions
+        return index
+
+
+def add_index(data, columns=True):
+    """Builds an InvertedIndex of a dataset, stored in its entry as data["index"]
+
+    By default (True), the key columns of the dataset are indexed.
+    """
+    df = data["df"]
+    if not isinstance(df, pd.DataFrame):
+        logging.warning(f"Unable to index data of type {type(df)}")
+        return
+    if columns is True:
+        columns = [key for key in data.get("keys", []) if key in df.columns]
+    start = time.time()
+    data["index"] = InvertedIndex(df, columns)
+    logging.info(f"Indexed {columns} in {time.time() - start:.2f}s")
+
+
+def add_regions(df, regions):
+    """Adds the code and name of the region containing the location of each row
+
+    regions lists geojson resources (see bento.resources), or maps each to the
+    column for its codes, so that both states and counties can be added, as in
+    {"us_states": "state_fips", "us_counties": "fips"}. The codes go in the columns
+    choropleths use for the resource, as its name does unless the frame has one.
+    Locations are read from the latitude and longitude columns, and rows outside
+    every region get missing values. Both columns are categoricals. Raises a
+    ValueError if the codes of two resources would go in the same column, as those
+    of us_states and us_counties do by default.
+    """
+    from bento import resources
+
+    if isinstance(regions, str):
+        regions = [regions]
+    if not isinstance(regions, dict):
+        regions = {uid: None for uid in regions}
+    columns = {}
+    for uid, code_column in regions.items():
+        default = (f"{uid}_code", uid, "name")
+        code_default, name_column, name_key = resources.region_columns.get(uid, default)
+        columns[uid] = (code_column or code_default, name_column, name_key)
+    targets = [code_column for code_column, _, _ in columns.values()]
+    shared = sorted({column for column in targets if targets.count(column) > 1})
+    if shared:
+        raise ValueError(
+            f"The codes of {list(regions)} would share the columns {shared}, so map"
+            " each resource to a column of its own, e.g. {'us_states': 'state_fips'}"
+        )
+
+    df = df.copy(deep=False)
+    start = time.time()
+    for uid, (code_column, name_column, name_key) in columns.items():
+        index = resources.region_index(uid)
+        positions = index.locate(df["longitude"], df["latitude"])
+        codes = [str(code) for code in index.ids]
+        df[code_column] = _region_labels(codes, positions)
+        if name_column not in df.columns:
+            names = [str(item.get(name_key, "")) for item in index.properties]
+            df[name_column] = _region_labels(names, positions)
+    logging.debug(f"Located rows in {list(regions)} in {time.time() - start:.2f}s")
+    return df
+
+
+def _region_labels(labels, positions):
+    """A categorical of the label at each position, missing where it's -1"""
+    uniques, inverse = np.unique(np.array(labels, dtype=object), return_inverse=True)
+    codes = np.where(positions >= 0, inverse[positions], -1)
+    return pd.Categorical.from_codes(codes, uniques)
+
+
+class GroupTotals:
+    """Totals of columns over the groups of key columns, kept between selections
+
+    The groups of each set of keys are numbered once, so summing a column over
+    the groups of some rows is a single bincount. The totals of each selection
+    are kept (up to cache_size of them), so a selection seen before costs
+    nothing, and one that only adds a filter value only sums the rows with that
+    value (see bento.util.rank). Only valid for the frame it was built from, which
+    has rows rows.
+    """
+
+    def __init__(self, idf, version=0, cache_size=256):
+        self.rows = len(idf)
+        self.version = version
+        self.cache_size = cache_size
+        self._groupings = {}
+        self._values = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def grouping(self, idf, keys):
+        """The group number of each row (-1 for none) and the keys of each group"""
+        keys = tuple(keys)
+        if keys not in self._groupings:
+            grouped = idf.groupby(list(keys), observed=True)
+            codes = grouped.ngroup().fillna(-1).to_numpy().astype(np.int64)
+            groups = grouped.size().index.to_frame(index=False)
+            self._groupings[keys] = (codes, groups)
+        return self._groupings[keys]
+
+    def values(self, idf, column):
+        """The column as floats, with missing values counting as zero in a sum"""
+        if column not in self._values:
+            self._values[column] = np.nan_to_num(idf[column].to_numpy(np.float64))
+        return self._values[column]
+
+    def get(self, key):
+        with self._lock:
+            totals = self._totals.pop(key, None)
+            if totals is not None:
+                self._totals[key] = totals
+            return totals
+
+    def put(self, key, totals):
+        with self._lock:
+            self._totals.pop(key, None)
+            self._totals[key] = totals
+            # Dicts keep their order of insertion, so the first is the least recent
+            while len(self._totals) > self.cache_size:
+                del self._totals[next(iter(self._totals))]
+
+    def tally(self, idf, keys, column, positions, labels=None, nlabels=1):
+        """Sums and counts of the column over the groups, for the rows at positions
+
+        The rows are tallied separately for each of their labels (from 0 up to
+        nlabels), into an array of shape (nlabels, 2, groups).
+        """
+        codes, groups = self.grouping(idf, keys)
+        codes = codes[positions]
+        values = self.values(idf, column)[positions]
+        keep = codes >= 0
+        if labels is not None:
+            keep &= labels >= 0
+            codes = labels * len(groups) + codes
+        size = nlabels * len(groups)
+        sums = np.bincount(codes[keep], weights=values[keep], minlength=size)
+        counts = np.bincount(codes[keep], minlength=size)
+        return np.stack(
+            [sums.reshape(nlabels, -1), counts.reshape(nlabels, -1)], axis=1
+        )
+
+
+def group_totals(data):
+    """The GroupTotals of a dataset, rebuilt when its frame is replaced
+
+    The totals are kept in data["totals"], and only available for data held in a
+    single DataFrame.
+    """
+    df = data["df"]
+    if not isinstance(df, pd.DataFrame):
+        return None
+    totals = data.get("totals")
+    version = data.get("version", 0)
+    if totals is None or totals.version != version or totals.rows != len(df):
+        totals = data["totals"] = GroupTotals(df, version=version)
+    return totals
+
+
+class FrameCache:
+    """Frames derived from a dataset, like its filtered rows, kept for reuse
+
+    The callbacks fired by one interaction usually filter the data the same way,
+    so the first to need a frame computes it and the others wait for it, then
+    reuse it. The least recently used frames are dropped to keep the total within
+    max_mb megabytes. Only valid for one version of the dataset (see refresh).
+    """
+
+    def __init__(self, max_mb=FRAME_CACHE_MB, version=0):
+        self.max_bytes = max_mb * 2 ** 20
+        self.version = version
+        self.nbytes = 0
+        self._frames = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """Returns the frame (or list of frames) for key, computing it if needed"""
+        with self._lock:
+            if key in self._frames:
+                # Dicts keep their order of insertion, so the first is the least recent
+                self._frames[key] = self._frames.pop(key)
+                return self._frames[key][0]
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = futures.Future()
+                future.set_running_or_notify_cancel()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return future.result()
+
         try:
-            logging.debug(f"Searching for {filename} at {loc}")
-            df = pd.read_csv(f"{loc}/{filename}", **args)
-            return df
-        except FileNotFoundError:
-            pass
+            value = compute()
+        except BaseException as exc:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(exc)
+            raise
+        with self._lock:
+            self._store(key, value)
+            del self._pending[key]
+        future.set_result(value)
+        return value
+
+    def _store(self, key, value):
+        frames = value if isinstance(value, list) else [value]
+        nbytes = sum(int(frame.memory_usage(deep=False).sum()) for frame in frames)
+        if nbytes > self.max_bytes:
+            return
+        self._frames[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, dropped = self._frames.pop(next(iter(self._frames)))
+            self.nbytes -= dropped
+
+
+def add_frame_cache(data, max_mb=FRAME_CACHE_MB):
+    """Sets how many megabytes of frames a dataset keeps, see frame_cache"""
+    data["frames"] = FrameCache(max_mb, version=data.get("version", 0))
+
+
+def frame_cache(data):
+    """The FrameCache of a dataset, started afresh when its frame is replaced
+
+    The cache is kept in data["frames"], and has FRAME_CACHE_MB megabytes unless
+    set by add_frame_cache.
+    """
+    cache = data.get("frames")
+    version = data.get("version", 0)
+    if cache is None or cache.version != version:
+        max_mb = FRAME_CACHE_MB if cache is None else cache.max_bytes / 2 ** 20
+        cache = data["frames"] = FrameCache(max_mb, version=version)
+    return cache
+
+
+def write_partitions(chunks, directory):
+    """Stores a sequence of DataFrames as the partitions of a Partitions dataset"""
+    directory = pathlib.Path(directory)
+    tmp_dir = _tmp_path(directory)
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    profile = None
+    try:
+        for idx, chunk in enumerate(chunks):
+            write_columns(chunk, tmp_dir / f"part-{idx:05d}")
+            chunk_profile = profile_df(chunk)
+            if profile is None:
+                profile = chunk_profile
+            else:
+                profile = merge_profiles(profile, chunk_profile)
+        write_profile(profile, tmp_dir / "profile.json")
+        tmp_dir.rename(directory)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def compact_df(idf, keys=(), float32=False, max_ratio=CATEGORY_RATIO, level="info"):
+    """Shrinks a DataFrame in memory by converting columns to smaller dtypes
+
+    Text columns listed in keys, or with few distinct values relative to the row
+    count, become categoricals. Integers are downcast to the smallest type that
+    holds their values, and floats optionally to float32. Besides saving memory,
+    categorical keys make the isin/groupby calls of callbacks much faster.
+    """
+    before = idf.memory_usage(deep=True).sum()
+    odf = idf.copy(deep=False)
+    for column, series in idf.items():
+        dtype = series.dtype
+        if dtype == object:
+            distinct = series.nunique()
+            if column in keys or distinct <= max_ratio * len(series):
+                try:
+                    odf[column] = series.astype("category")
+                except TypeError:
+                    logging.debug(f"Unable to make {column} categorical")
+        elif pd.api.types.is_integer_dtype(dtype):
+            odf[column] = pd.to_numeric(series, downcast="integer")
+        elif pd.api.types.is_float_dtype(dtype) and float32:
+            odf[column] = series.astype("float32")
+
+    after = odf.memory_usage(deep=True).sum()
+    message = f"Compacted data from {before / 1e6:.1f}MB to {after / 1e6:.1f}MB"
+    getattr(logging, level)(message)
+    return odf
 
-    logging.warning(f"Unable to load {filename} from any of {location_list}")
 
+def _sort_rows(df, sort):
+    # A stable sort, so rows with equal values keep their order in the source
+    return df.sort_values(sort, kind="mergesort", ignore_index=True)
 
-def autostructure(idf, mods=None):
+
+def _parse_csv(path, args, compact=False, sort=None, regions=None):
+    df = pd.read_csv(path, **args)
+    if regions:
+        df = add_regions(df, regions)
+    if sort:
+        df = _sort_rows(df, sort)
+    if not compact:
+        return df
+    return compact_df(df, **(compact if isinstance(compact, dict) else {}))
+
+
+def _parse_csv_chunks(path, args, chunksize, compact=False, sort=None, regions=None):
+    compact_args = compact if isinstance(compact, dict) else {}
+    for idx, chunk in enumerate(pd.read_csv(path, chunksize=chunksize, **args)):
+        logging.debug(f"Ingesting rows from {idx * chunksize} of {path}")
+        if regions:
+            chunk = add_regions(chunk, regions)
+        if sort:
+            chunk = _sort_rows(chunk, sort)
+        if compact:
+            chunk = compact_df(chunk, level="debug", **compact_args)
+        yield chunk
+
+
+def _load_partitions(path, args, cache_path, chunksize, compact, sort, regions):
+    if not cache_path.is_dir():
+        logging.info(f"Ingesting {path} in chunks of {chunksize} rows")
+        chunks = _parse_csv_chunks(path, args, chunksize, compact, sort, regions)
+        write_partitions(chunks, cache_path)
+        prune_cache(cache_path)
+    return Partitions(cache_path)
+
+
+def df_loader(
+    filename,
+    package="bento",
+    parse_dates=None,
+    location=".",
+    cache=True,
+    mmap=False,
+    profile=False,
+    compact=False,
+    chunksize=None,
+    sort=None,
+    regions=None,
+):
+    """Loads a CSV file as a DataFrame, via a binary cache when possible
+
+    cache: bool
+        Keep the parsed columns in a folder next to the source, so later loads can
+        skip parsing the CSV.
+    mmap: bool
+        Memory-map the cached columns as read-only arrays (implies cache). Every
+        process loading the same file, such as the workers of a Bento app, then
+        shares a single copy of the data. Object (text) columns are still read into
+        each process's memory, unless compact makes them categoricals.
+    profile: bool
+        Return only a profile of the data (see profile_df) rather than the
+        DataFrame. This is cached next to the source, so it is usually immediate.
+    compact: bool or dict
+        Convert columns to smaller dtypes as they are loaded (see compact_df).
+        A dict supplies the keyword arguments, e.g. {"float32": True}.
+    chunksize: int
+        Stream the CSV in blocks of this many rows, writing each block to the
+        cache as a partition, and return a Partitions object instead of a
+        DataFrame. This is for datasets that don't fit in memory.
+    sort: str
+        Order the rows by this column, usually the date, marking the frame as
+        sorted in its attrs. Range filters on the column then find the matching
+        rows by binary search, as a slice of the frame (see butil.filter_df).
+        With chunksize, the rows are sorted within each partition.
+    regions: list or dict
+        Geojson resources, like "us_states", whose regions are added to each row
+        by its latitude and longitude (see add_regions). Points can then feed
+        choropleths, without any geometry being handled in the callbacks.
+    """
+    args = {
+        "parse_dates": parse_dates or [],
+        "infer_datetime_format": True,
+    }
+    # Compaction and partitioning happen before caching, so are part of the key
+    cache_args = {**args, "compact": compact} if compact else args
+    if chunksize:
+        cache_args = {**cache_args, "chunksize": chunksize}
+    if sort:
+        cache_args = {**cache_args, "sort": sort}
+    if regions:
+        cache_args = {**cache_args, "regions": regions}
+    path = find_file(filename, package=package, location=location)
+    if path is None:
+        return
+    # Marks how much of the source was read, for picking up appended rows later
+    source = {"path": str(path), "offset": path.stat().st_size, "args": args}
+    attrs = {"source": source, "sorted": sort} if sort else {"source": source}
+    if regions:
+        attrs["regions"] = regions
+
+    if not (cache or mmap or profile):
+        return _with_attrs(_parse_csv(path, args, compact, sort, regions), attrs)
+
+    # A warm start reads the parsed columns back, skipping CSV tokenizing entirely
+    cache_path = cache_location(path, cache_args)
+    if chunksize:
+        parts = _load_partitions(
+            path, args, cache_path, chunksize, compact, sort, regions
+        )
+        return parts.profile if profile else _with_attrs(parts, attrs)
+    if profile:
+        return _load_profile(path, args, cache_path, cache, regions)
+
+    if not cache_path.is_dir():
+        df = _parse_csv(path, args, compact, sort, regions)
+        try:
+            write_columns(df, cache_path)
+            prune_cache(cache_path)
+        except OSError as exc:
+            logging.debug(f"Unable to cache {filename} at {cache_path}: {exc}")
+        # Without mmap, there is no need to read back what we just parsed
+        if not mmap or not cache_path.is_dir():
+            return _with_attrs(df, attrs)
+
+    try:
+        logging.debug(f"Loading {filename} from cache {cache_path}")
+        df = read_columns(cache_path, mmap=mmap)
+    except Exception as exc:
+        logging.warning(f"Ignoring unreadable cache entry {cache_path}: {exc}")
+        return _with_attrs(_parse_csv(path, args, compact, sort, regions), attrs)
+
+    private = list(df.select_dtypes("object").columns)
+    if mmap and private:
+        logging.debug(f"Columns {private} of {filename} are not shared")
+    return _with_attrs(df, attrs)
+
+
+def _with_attrs(df, attrs):
+    df.attrs.update(attrs)
+    return df
+
+
+def load_datasets(loaders, workers=None):
+    """Runs dataset loaders concurrently, returning the results by dataid
+
+    loaders: dict
+        Maps each dataid to a function taking no arguments that loads it.
+    workers: int
+        Size of the thread pool. Parsing and file reads release the GIL, so
+        threads overlap most of the loading time.
+    """
+
+    def timed(dataid, loader):
+        start = time.time()
+        result = loader()
+        logging.info(f"  {dataid}: loaded in {time.time() - start:.2f}s")
+        return result
+
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        tasks = {
+            dataid: executor.submit(timed, dataid, loader)
+            for dataid, loader in loaders.items()
+        }
+        return {dataid: task.result() for dataid, task in tasks.items()}
+
+
+def read_appended(source):
+    """Parses the complete rows added to a CSV source since it was last read
+
+    Returns the new rows as a DataFrame along with the updated source, or None for
+    the rows when nothing has been appended. A partially written last line is left
+    for the next call.
+    """
+    path = pathlib.Path(source["path"])
+    size = path.stat().st_size
+    if size < source["offset"]:
+        raise ValueError(f"{path} shrank since it was loaded, so was not appended to")
+    with open(path, "rb") as fh:
+        header = fh.readline()
+        fh.seek(source["offset"])
+        block = fh.read(size - source["offset"])
+    end = block.rfind(b"\n") + 1
+    if not end:
+        return None, source
+
+    rows = pd.read_csv(io.BytesIO(header + block[:end]), **source["args"])
+    return rows, {**source, "offset": source["offset"] + end}
+
+
+def _append_rows(df, rows):
+    """Concatenates rows onto a copy of df, growing its categories as needed"""
+    df = df.copy(deep=False)
+    for column, series in df.items():
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            values = pd.Index(rows[column].dropna().unique())
+            extra = values.difference(series.cat.categories)
+            df[column] = series.cat.add_categories(extra)
+            rows[column] = rows[column].astype(df[column].dtype)
+    # Integers downcast by compact_df are upcast again if the new rows need it
+    return pd.concat([df, rows], ignore_index=isinstance(df.index, pd.RangeIndex))
+
+
+def refresh(data):
+    """Adds the rows appended to the source of a dataset since it was loaded
+
+    data is an entry of the application data, as returned by a loader built on
+    df_loader. Only the new rows are parsed, then a new frame (or partition) with
+    them is swapped into data["df"], so callbacks in progress keep a consistent
+    view. Its index, cube and profile are all built first, then published with the
+    frame in a single update of data. Each refresh that adds rows increments
+    data["version"], which anything caching results derived from the data should
+    include in its key.
+
+    Returns the number of rows added.
+    """
+    df = data["df"]
+    attrs = dict(df.attrs)
+    if "source" not in attrs:
+        raise ValueError("Only data loaded with df_loader can be refreshed")
+    rows, source = read_appended(attrs["source"])
+    if rows is None or rows.empty:
+        return 0
+
+    if attrs.get("regions"):
+        rows = add_regions(rows, attrs["regions"])
+    sort = attrs.get("sorted")
+    if sort:
+        rows = _sort_rows(rows, sort)
+    if isinstance(df, Partitions):
+        # Like chunked ingestion, each partition has categories of its own
+        last = read_columns(df.paths[-1], mmap=True)
+        for column in last.select_dtypes("category"):
+            rows[column] = rows[column].astype("category")
+        start = df.attrs["source"]["offset"]
+        df = df.append(rows, f"{len(df.paths):05d}-{start}-{source['offset']}")
+    else:
+        in_order = not sort or df.empty or rows[sort].iloc[0] >= df[sort].iloc[-1]
+        df = _append_rows(df, rows)
+        # Rows appended out of order mean sorting the whole frame again
+        if not in_order:
+            df = _sort_rows(df, sort)
+    df.attrs = {**attrs, "source": source}
+
+    updates = {"df": df, "version": data.get("version", 0) + 1}
+    index = data.get("index")
+    if index and isinstance(df, pd.DataFrame):
+        if in_order:
+            updates["index"] = index.append(rows)
+        else:
+            updates["index"] = InvertedIndex(df, list(index.positions))
+    if data.get("profile"):
+        updates["profile"] = merge_profiles(data["profile"], profile_df(rows))
+    if data.get("cube"):
+        updates["cube"] = data["cube"].append(rows)
+    # The frame and everything derived from it are replaced in one step
+    data.update(updates)
+    logging.debug(f"Appended {len(rows)} rows from {source['path']}")
+    return len(rows)
+
+
+def watch_dataset(dataid, data, interval):
+    """Refreshes a dataset every interval seconds from a background thread"""
+
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                refresh(data)
+            except Exception as exc:
+                logging.warning(f"Unable to refresh {dataid}: {exc}")
+
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    return thread
+
+
+def autostructure(idf, mods=None, compact=False):
+    if compact:
+        idf = compact_df(idf, **(compact if isinstance(compact, dict) else {}))
     dates = [key for key, val in dict(idf.dtypes).items() if "date" in val.__str__()]
-    keys = [key for key, val in dict(idf.dtypes).items() if val.__str__() == "object"]
+    keys = [
+        key
+        for key, val in dict(idf.dtypes).items()
+        if val.__str__() in ("object", "category")
+    ]
     numeric = {
         key: int if "int" in val.__str__() else float
         for key, val in dict(idf.dtypes).items()
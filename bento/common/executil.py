@@ -0,0 +1,133 @@
+"""This is a collection of utilities for running Bento callbacks in worker processes"""
+
+import atexit
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent import futures
+
+from bento.common import datautil, logger
+
+logging = logger.fancy_logger(__name__)
+
+# Seconds to wait on a worker before the callback fails
+RESULT_TIMEOUT = 60
+
+_pool = None
+_pool_pid = None
+_data = None
+_lock = threading.Lock()
+
+
+def can_fork():
+    """Whether worker processes can be forked, inheriting the data of the app"""
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def start_pool(data, workers=None):
+    """Forks the pool of worker processes, which inherit the data of the app
+
+    This must be called once the data has loaded and the functions the workers run
+    are defined, but before any other threads start (like those of
+    datautil.watch_dataset or the server), as a process forked while another thread
+    holds a lock would find it held forever. The workers are all forked here, rather
+    than as callbacks arrive. A refresh of the data is picked up by each worker
+    reading the appended rows itself (see _call).
+    """
+    global _pool, _pool_pid, _data
+    if not can_fork():
+        logging.warning("Processes can't be forked here, so callbacks run inline")
+        return
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            return
+        _data = data
+        context = multiprocessing.get_context("fork")
+        _pool = futures.ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        _pool_pid = os.getpid()
+        # A pool using fork starts all of its workers on the first submit
+        _pool.submit(os.getpid).result()
+
+
+def process_pool():
+    """The pool started by start_pool in this process, or None
+
+    A process forked after the pool started, like each gunicorn worker of a
+    preloaded app, can't use the pool of its parent.
+    """
+    with _lock:
+        return _pool if _pool_pid == os.getpid() else None
+
+
+def _offsets(data):
+    """How much of the source of each dataset has been read, see datautil.refresh"""
+    offsets = {}
+    for dataid, entry in (data or {}).items():
+        attrs = getattr(entry.get("df"), "attrs", {})
+        if "source" in attrs:
+            offsets[dataid] = attrs["source"]["offset"]
+    return offsets
+
+
+def _call(module, name, args, offsets):
+    """Runs the function called name of module in a worker, returning (True, result)
+
+    The function is looked up here by name, so one defined after the workers forked
+    returns (False, None) rather than breaking the pool. Any refreshed data is
+    caught up with first.
+    """
+    func = sys.modules.get(module)
+    for part in name.split("."):
+        func = getattr(func, part, None)
+    if func is None:
+        return False, None
+    for dataid, offset in offsets.items():
+        entry = _data[dataid]
+        if entry["df"].attrs["source"]["offset"] < offset:
+            datautil.refresh(entry)
+    return True, func(*args)
+
+
+def run_in_process(func, *args, data=None, timeout=RESULT_TIMEOUT):
+    """Runs func(*args) in a worker process, returning the result
+
+    func must be a module level function defined before the workers forked (see
+    start_pool), and args and the result picklable. The data is the application data
+    the workers were started with. Where there is no pool, the pool has broken, or
+    the workers don't have func, it runs here instead. A worker taking longer than
+    the timeout raises a TimeoutError, rather than the work being done twice.
+    """
+    pool = process_pool()
+    if pool is None:
+        return func(*args)
+    try:
+        future = pool.submit(
+            _call, func.__module__, func.__qualname__, args, _offsets(data)
+        )
+        found, result = future.result(timeout=timeout)
+    except futures.TimeoutError:
+        future.cancel()
+        logging.warning(f"{func.__qualname__} took over {timeout}s in a worker")
+        raise
+    except futures.process.BrokenProcessPool:
+        # Forking again from a running app isn't safe, so the callbacks stay here
+        logging.warning("The process pool has broken, running callbacks inline")
+        reset_pool()
+        return func(*args)
+    if not found:
+        logging.warning(f"The workers don't have {func.__qualname__}, running it here")
+        return func(*args)
+    return result
+
+
+def reset_pool():
+    """Drops the pool, so callbacks run inline until start_pool is called again"""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False)
+        _pool, _pool_pid = None, None
+
+
+atexit.register(reset_pool)
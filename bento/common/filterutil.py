@@ -0,0 +1,152 @@
+"""This is a collection of utilities for evaluating the filters of Bento callbacks
+
+Filters map a logic to the values selected for each column, as in
+{"or": {"state": ["Texas", "Ohio"]}, "gt": {"population": [1e6]}}. Besides selecting
+values ("or"/"and", the traces of a graph being split by them), these logics keep
+the rows where the column is:
+
+    between   between two values, inclusive
+    not_in    none of the values
+    null      missing (the values are ignored)
+    not_null  not missing (the values are ignored)
+    gt, ge, lt, le, ne
+              greater than, at least, less than, at most or not equal to the value
+"""
+
+import numpy as np
+
+from bento.common import logger
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+logging = logger.fancy_logger(__name__)
+
+# The comparisons, with their operators
+COMPARISONS = {"gt": ">", "ge": ">=", "lt": "<", "le": "<=", "ne": "!="}
+
+# Every logic a filter can use
+LOGICS = {"or", "and", "between", "not_in", "null", "not_null", *COMPARISONS}
+
+# Logics selecting values, which split a graph into one trace per value
+SELECTIONS = {"or", "and"}
+
+
+def compile_filters(filters):
+    """Compiles filters into a list of (column, logic, values) conditions
+
+    Any datetime values are converted once, here, rather than for every frame the
+    conditions are evaluated on (see filter_mask).
+    """
+    conditions = []
+    for logic, columns in filters.items():
+        if logic not in LOGICS:
+            logging.warning(f"Ignoring the unknown filter logic {logic}")
+            continue
+        for column, values in columns.items():
+            conditions.append(compile_condition(column, logic, values))
+    return conditions
+
+
+def compile_condition(column, logic, values):
+    """Compiles the filter of one column, see compile_filters"""
+    values = list(values)
+    if values and "datetime" in str(type(values[0])):
+        values = [np.datetime64(item) for item in values]
+    return (column, logic, values)
+
+
+def filters_key(filters, ordered=False):
+    """A hashable key for the filters, regardless of the order of their columns
+
+    With ordered, filters on the same columns in another order get another key, for
+    results that follow the order, like the traces of a graph.
+    """
+    items = (
+        (logic, column, tuple(values))
+        for logic, columns in filters.items()
+        for column, values in columns.items()
+    )
+    if ordered:
+        return tuple(items)
+    return tuple(sorted(items, key=lambda item: item[:2]))
+
+
+def _compare(series, logic, values):
+    """The mask of a range or comparison, for the rows of a Series"""
+    # TODO generalize filters to handle types
+    try:
+        return _comparison_mask(series, logic, values)
+    except TypeError:
+        # Date sliders give their bounds as integer nanoseconds
+        return _comparison_mask(series.astype(int), logic, values)
+
+
+def _comparison_mask(series, logic, values):
+    if logic == "between":
+        return ((series >= values[0]) & (series <= values[1])).to_numpy()
+    if logic == "gt":
+        return (series > values[0]).to_numpy()
+    if logic == "ge":
+        return (series >= values[0]).to_numpy()
+    if logic == "lt":
+        return (series < values[0]).to_numpy()
+    if logic == "le":
+        return (series <= values[0]).to_numpy()
+    return (series != values[0]).to_numpy()
+
+
+def _is_numeric(series, values):
+    """Whether comparing the column to the values can be left to numexpr"""
+    dtype = series.dtype
+    if not isinstance(dtype, np.dtype) or dtype.kind not in "iuf":
+        return False
+    return all(
+        isinstance(value, (int, float, np.integer, np.floating))
+        and not isinstance(value, bool)
+        for value in values
+    )
+
+
+def filter_mask(idf, conditions, positions=None):
+    """Evaluates the conditions together, as one boolean mask over the rows of idf
+
+    When positions are given, only the rows at those positions are evaluated. With
+    numexpr installed, the comparisons of numeric columns are combined into one
+    expression, evaluated in a single pass over the columns. The remaining
+    conditions are combined into the same mask, in place.
+    """
+    rows = len(idf) if positions is None else len(positions)
+    mask = np.ones(rows, dtype=bool)
+    terms = []
+    local = {}
+    for column, logic, values in conditions:
+        series = idf[column]
+        if positions is not None:
+            series = series.take(positions)
+        if logic in SELECTIONS:
+            mask &= series.isin(values).to_numpy()
+        elif logic == "not_in":
+            mask &= ~series.isin(values).to_numpy()
+        elif logic == "null":
+            mask &= series.isna().to_numpy()
+        elif logic == "not_null":
+            mask &= series.notna().to_numpy()
+        elif numexpr is not None and _is_numeric(series, values):
+            name = f"c{len(local)}"
+            local[name] = series.to_numpy()
+            bounds = []
+            for value in values[: 2 if logic == "between" else 1]:
+                bounds.append(f"v{len(local)}")
+                local[bounds[-1]] = value
+            if logic == "between":
+                terms.append(f"({name} >= {bounds[0]}) & ({name} <= {bounds[1]})")
+            else:
+                terms.append(f"({name} {COMPARISONS[logic]} {bounds[0]})")
+        else:
+            mask &= _compare(series, logic, values)
+    if terms:
+        mask &= numexpr.evaluate(" & ".join(terms), local_dict=local)
+    return mask
@@ -0,0 +1,303 @@
+"""This is a collection of utilities for preparing the geometries drawn on Bento maps
+
+A choropleth sends its geojson to the browser with each figure, so the geometries
+are simplified to the detail a map can show at its zoom (see simplify_geojson) and cut
+down to the features the figure colors (see select_features). Points can also be
+assigned the region they fall in, so point data can feed choropleths (see RegionIndex).
+"""
+
+import json
+
+import numpy as np
+
+from bento.common import logger
+
+logging = logger.fancy_logger(__name__)
+
+# The zooms the geometries are simplified for, beyond which they're kept whole
+ZOOM_LEVELS = (2, 4, 6, 8)
+
+# Decimals of a degree the coordinates are rounded to, about a meter
+DECIMALS = 5
+
+
+def tolerance(zoom):
+    """Half the size of a map pixel at zoom, in degrees, the detail worth keeping"""
+    return 180 / (256 * 2 ** zoom)
+
+
+def zoom_level(zoom):
+    """The least detailed of ZOOM_LEVELS that shows a map at zoom, or None for all"""
+    for level in ZOOM_LEVELS:
+        if zoom is not None and zoom <= level:
+            return level
+    return None
+
+
+def simplify_geojson(geojson, zoom=None, decimals=DECIMALS):
+    """A copy of a FeatureCollection with its polygons simplified for maps at zoom
+
+    Rings are simplified with Douglas-Peucker to the tolerance of the zoom, and their
+    coordinates rounded to the decimals. Holes and parts of a feature that would
+    collapse are dropped, but never a whole feature, which keeps its quantized ring.
+    Without a zoom, the coordinates are just rounded. The properties of the features
+    are left out, as maps only match them to locations by their ids.
+    """
+    limit = tolerance(zoom) if zoom is not None else 0
+    features = []
+    for feature in geojson["features"]:
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            features.append(feature)
+            continue
+
+        simplified = []
+        for polygon in polygons:
+            rings = [_simplify_ring(ring, limit, decimals) for ring in polygon]
+            if rings and rings[0] is not None:
+                simplified.append([ring for ring in rings if ring is not None])
+        if not simplified:
+            # The largest part is kept, so the feature stays on the map
+            largest = max(polygons, key=lambda polygon: len(polygon[0]))
+            simplified = [[_simplify_ring(largest[0], 0, decimals, keep=True)]]
+
+        if geometry["type"] == "Polygon":
+            coordinates = simplified[0]
+        else:
+            coordinates = simplified
+        new_geometry = {**geometry, "coordinates": coordinates}
+        features.append({**feature, "properties": {}, "geometry": new_geometry})
+    return {**geojson, "features": features}
+
+
+def _simplify_ring(ring, limit, decimals, keep=False):
+    """The ring simplified and rounded, as lists, or None if it collapses"""
+    points = np.round(np.asarray(ring, dtype=float)[:, :2], decimals)
+    # Rounding can leave repeated points
+    repeated = np.zeros(len(points), dtype=bool)
+    repeated[1:] = (points[1:] == points[:-1]).all(axis=1)
+    points = points[~repeated]
+    if limit > 0 and len(points) > 4:
+        points = points[douglas_peucker(points, limit)]
+    if len(points) < 4 and not keep:
+        return None
+    return points.tolist()
+
+
+def douglas_peucker(points, limit):
+    """Mask of the points kept by Douglas-Peucker simplification to the limit
+
+    A point is kept if it's further than the limit from the segment between the
+    points kept around it. The first and last points are always kept, and may be the
+    same point, as they are for a ring.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, stop = stack.pop()
+        if stop - start < 2:
+            continue
+        inner = points[start + 1 : stop]
+        segment = points[stop] - points[start]
+        offsets = inner - points[start]
+        length = np.hypot(*segment)
+        if length > 0:
+            cross = segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]
+            distances = np.abs(cross) / length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = int(distances.argmax())
+        if distances[farthest] > limit:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            stack.append((start, middle))
+            stack.append((middle, stop))
+    return keep
+
+
+def select_features(geojson, locations):
+    """A FeatureCollection of only the features with the ids of the locations
+
+    Ids are compared as strings, as plotly matches locations to features.
+    """
+    wanted = {str(location) for location in locations}
+    features = [item for item in geojson["features"] if str(item.get("id")) in wanted]
+    return {**geojson, "features": features}
+
+
+class RegionIndex:
+    """Finds the feature of a FeatureCollection that contains each of many points
+
+    The points are binned into a uniform grid with cells about the size of a
+    feature. Each feature then only tests the points in the cells its bounding box
+    covers, with an even-odd ray cast against all the edges of its rings at once, so
+    holes and the parts of a MultiPolygon need no special handling.
+
+    Attributes
+    ----------
+    ids: array
+        The id of each feature.
+    properties: list
+        The properties of each feature.
+    """
+
+    def __init__(self, geojson):
+        self.ids = []
+        self.properties = []
+        edges = []
+        bounds = []
+        for feature in geojson["features"]:
+            geometry = feature.get("geometry") or {}
+            if geometry.get("type") == "Polygon":
+                rings = geometry["coordinates"]
+            elif geometry.get("type") == "MultiPolygon":
+                rings = [ring for part in geometry["coordinates"] for ring in part]
+            else:
+                continue
+            rings = [np.asarray(ring, dtype=float)[:, :2] for ring in rings]
+            rings = [ring for ring in rings if len(ring) > 2]
+            if not rings:
+                continue
+            # Each edge joins a point to the next, closing rings that aren't closed
+            starts = np.vstack(rings)
+            ends = np.vstack([np.roll(ring, -1, axis=0) for ring in rings])
+            edges.append(np.hstack([starts, ends]))
+            bounds.append([*starts.min(axis=0), *starts.max(axis=0)])
+            self.ids.append(feature.get("id"))
+            self.properties.append(feature.get("properties") or {})
+        self.ids = np.array(self.ids, dtype=object)
+        self.edges = edges
+        self.bounds = np.array(bounds).reshape(-1, 4)
+        sizes = self.bounds[:, 2:] - self.bounds[:, :2]
+        self.cell = float(np.median(sizes.max(axis=1))) if len(sizes) else 1.0
+        self.cell = self.cell or 1.0
+
+    def locate(self, lons, lats, chunk=2 ** 22):
+        """The position in ids of the feature containing each point, or -1 if none
+
+        chunk caps the number of point and edge pairs tested at once.
+        """
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        found = np.full(len(lons), -1, dtype=np.int64)
+        if not len(self.ids) or not len(lons):
+            return found
+
+        # Sort the points by their cell of a grid over all the features
+        low = self.bounds[:, :2].min(axis=0)
+        high = self.bounds[:, 2:].max(axis=0)
+        width = int((high[0] - low[0]) // self.cell) + 1
+        height = int((high[1] - low[1]) // self.cell) + 1
+        with np.errstate(invalid="ignore"):
+            columns = (lons - low[0]) // self.cell
+            rows = (lats - low[1]) // self.cell
+            inside = (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+        cells = np.where(inside, rows * width + columns, -1).astype(np.int64)
+        order = np.argsort(cells, kind="stable")
+        cells = cells[order]
+
+        for idx, (x0, y0, x1, y1) in enumerate(self.bounds):
+            # Integer cells, as searching the int cells with floats would copy them
+            first, last = ((np.array([x0, x1]) - low[0]) // self.cell).astype(np.int64)
+            bottom, top = ((np.array([y0, y1]) - low[1]) // self.cell).astype(np.int64)
+            row_cells = np.arange(bottom, top + 1, dtype=np.int64) * width
+            starts = np.searchsorted(cells, row_cells + first, side="left")
+            stops = np.searchsorted(cells, row_cells + last, side="right")
+            if not (stops > starts).any():
+                continue
+            ranges = [np.arange(start, stop) for start, stop in zip(starts, stops)]
+            candidates = order[np.concatenate(ranges)]
+            px, py = lons[candidates], lats[candidates]
+            keep = found[candidates] < 0
+            keep &= (px >= x0) & (px <= x1) & (py >= y0) & (py <= y1)
+            candidates, px, py = candidates[keep], px[keep], py[keep]
+            if len(candidates):
+                found[candidates[_contains(px, py, self.edges[idx], chunk)]] = idx
+        return found
+
+
+def _contains(px, py, edges, chunk):
+    """Whether each point is inside the rings made of the edges, by even-odd rule"""
+    x1, y1, x2, y2 = (edges[:, col] for col in range(4))
+    result = np.empty(len(px), dtype=bool)
+    step = max(1, chunk // len(edges))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for start in range(0, len(px), step):
+            x, y = px[start : start + step, None], py[start : start + step, None]
+            spans = (y1 > y) != (y2 > y)
+            crossings = spans & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+            result[start : start + step] = np.logical_xor.reduce(crossings, axis=1)
+    return result
+
+
+def pack_geojson(geojson):
+    """Splits a FeatureCollection into its structure and one array of coordinates
+
+    The rings of the polygons (as lists or arrays) are concatenated into a
+    (points, 2) array, and
+    replaced in the structure by their number, with offsets marking where each ring
+    starts in the array. The parts pickle far smaller and load far faster than the
+    nested lists, see unpack_geojson.
+    """
+    rings = []
+
+    def number(ring):
+        rings.append(ring)
+        return len(rings) - 1
+
+    structure = _map_rings(geojson, number)
+    lengths = [len(ring) for ring in rings]
+    offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+    points = np.empty((offsets[-1], 2))
+    for start, ring in zip(offsets, rings):
+        points[start : start + len(ring)] = np.asarray(ring, dtype=float)[:, :2]
+    return structure, points, offsets
+
+
+def unpack_geojson(structure, points, offsets):
+    """The FeatureCollection split up by pack_geojson
+
+    Each ring is a (points, 2) array viewing the one array of coordinates, so none of
+    them are copied into lists. See as_lists or to_json for plain GeoJSON.
+    """
+    rings = np.split(points, offsets[1:-1])
+    return _map_rings(structure, lambda idx: rings[idx])
+
+
+def as_lists(geojson):
+    """A copy of a FeatureCollection with any rings that are arrays as lists"""
+    return _map_rings(geojson, lambda ring: np.asarray(ring).tolist())
+
+
+def _map_rings(geojson, func):
+    """A copy of a FeatureCollection with func applied to the rings of its polygons"""
+    features = []
+    for feature in geojson["features"]:
+        geometry = feature.get("geometry") or {}
+        coordinates = geometry.get("coordinates")
+        if geometry.get("type") == "Polygon":
+            coordinates = [func(ring) for ring in coordinates]
+        elif geometry.get("type") == "MultiPolygon":
+            coordinates = [[func(ring) for ring in part] for part in coordinates]
+        else:
+            features.append(feature)
+            continue
+        new_geometry = {**geometry, "coordinates": coordinates}
+        features.append({**feature, "geometry": new_geometry})
+    return {**geojson, "features": features}
+
+
+def to_json(geojson):
+    """Compact JSON of a FeatureCollection, with any rings that are arrays as lists"""
+
+    def default(value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        raise TypeError(f"{type(value).__name__} isn't JSON serializable")
+
+    return json.dumps(geojson, separators=(",", ":"), default=default)
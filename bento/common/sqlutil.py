@@ -0,0 +1,355 @@
+"""This is a collection of utilities for serving Bento data from a SQLite database"""
+
+import os
+import pathlib
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from bento.common import logger, datautil, filterutil
+
+logging = logger.fancy_logger(__name__)
+
+# The reductions of bento.util.aggregate that can run in the database
+SQL_REDUCTIONS = {"sum": "SUM", "mean": "AVG", "max": "MAX", "min": "MIN"}
+
+
+def quote(name):
+    """Quotes an identifier (table or column name) for use in SQL"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _column_dtype(declared, is_date=False):
+    """Maps a declared SQLite column type to the dtype pandas would give it"""
+    declared = declared.upper()
+    if is_date or "DATE" in declared or "TIME" in declared:
+        return "datetime64[ns]"
+    if "INT" in declared:
+        return "int64"
+    if any(name in declared for name in ("REAL", "FLOA", "DOUB", "NUM", "DEC")):
+        return "float64"
+    return "object"
+
+
+def _trace_name(name, value):
+    try:
+        return name + " " + value
+    except Exception:
+        return name + " " + pd.to_datetime(value).strftime("%Y-%m-%d")
+
+
+def trace_specs(filters):
+    """Splits filters into the traces bento.util.prepare_traces would make
+
+    Returns the name of each trace, in order, with the conditions selecting it.
+    A condition is a (column, operator, value) triple, the operator being "=" for
+    a selected value, else the logic of the filter (see filterutil).
+    """
+    specs = [("", [])]
+    for logic, columns in filters.items():
+        new_specs = []
+        for column, values in columns.items():
+            for name, conditions in specs:
+                if logic not in filterutil.SELECTIONS:
+                    condition = (column, logic, values)
+                    new_specs.append((name, conditions + [condition]))
+                    continue
+                for value in values:
+                    condition = (column, "=", value)
+                    new_specs.append(
+                        (_trace_name(name, value), conditions + [condition])
+                    )
+        specs = new_specs
+    return specs
+
+
+def filter_conditions(filters):
+    """Converts filters into the conditions bento.util.filter_df applies"""
+    conditions = []
+    for logic, columns in filters.items():
+        for column, values in columns.items():
+            if logic in filterutil.SELECTIONS:
+                conditions.append((column, "in", values))
+            elif logic in filterutil.LOGICS:
+                conditions.append((column, logic, values))
+    return conditions
+
+
+class SqlTable:
+    """A table in a SQLite database, standing in for a DataFrame
+
+    The bento.util functions filter, group and reduce a SqlTable with SQL, so
+    only their (usually small) results are loaded into pandas. Each thread of
+    each worker process keeps its own read-only connection to the database.
+    Date columns are those declared as a date/time type, plus any in
+    parse_dates, and are compared with SQLite's datetime function.
+    """
+
+    def __init__(self, path, table, parse_dates=None, cap=datautil.UNIQUE_CAP):
+        self.path = pathlib.Path(path)
+        self.table = table
+        self.attrs = {}
+        self._local = threading.local()
+
+        parse_dates = parse_dates or []
+        info = self.query(f"PRAGMA table_info({quote(table)})")
+        if info.empty:
+            raise ValueError(f"No table {table} in {self.path}")
+        self.dtypes = {
+            row["name"]: _column_dtype(row["type"], row["name"] in parse_dates)
+            for _, row in info.iterrows()
+        }
+        self.dates = [col for col, dtype in self.dtypes.items() if "date" in dtype]
+        self.profile = self._profile(cap)
+
+    def connection(self):
+        """Returns the connection for this thread, opening one if needed"""
+        local = self._local
+        # Connections can't be shared with a forked worker, so check the process
+        if getattr(local, "pid", None) != os.getpid():
+            uri = f"{self.path.resolve().as_uri()}?mode=ro"
+            local.connection = sqlite3.connect(uri, uri=True)
+            local.pid = os.getpid()
+        return local.connection
+
+    def query(self, sql, params=()):
+        """Runs a query, returning the result as a DataFrame"""
+        logging.debug(f"Querying {self.path}: {sql} {params}")
+        odf = pd.read_sql_query(sql, self.connection(), params=list(params))
+        for column in getattr(self, "dates", []):
+            if column in odf:
+                odf[column] = pd.to_datetime(odf[column])
+        # A column of only missing values comes back untyped
+        for column, dtype in getattr(self, "dtypes", {}).items():
+            if dtype == "float64" and column in odf and odf[column].dtype == object:
+                odf[column] = odf[column].astype(float)
+        return odf
+
+    def _profile(self, cap):
+        """Profiles the table in a single scan (see datautil.profile_df)"""
+        stats = ["COUNT(*)"]
+        for column in self.dtypes:
+            col = quote(column)
+            stats.extend([f"MIN({col})", f"MAX({col})", f"COUNT(DISTINCT {col})"])
+        row = (
+            self.connection()
+            .execute(f"SELECT {', '.join(stats)} FROM {quote(self.table)}")
+            .fetchone()
+        )
+
+        profile = {
+            "rows": row[0],
+            "columns": list(self.dtypes),
+            "dtypes": dict(self.dtypes),
+            "uniques": {},
+            "min": {},
+            "max": {},
+        }
+        for idx, column in enumerate(self.dtypes):
+            minimum, maximum, distinct = row[1 + 3 * idx : 4 + 3 * idx]
+            profile["min"][column] = minimum
+            profile["max"][column] = maximum
+            uniques = None
+            if distinct <= cap:
+                col = quote(column)
+                sql = f"SELECT DISTINCT {col} FROM {quote(self.table)}"
+                cursor = self.connection().execute(f"{sql} WHERE {col} IS NOT NULL")
+                uniques = [value for (value,) in cursor]
+            profile["uniques"][column] = uniques
+        return datautil._finish_profile(profile)
+
+    def _param(self, column, value):
+        if column in self.dates:
+            return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+        return value.item() if hasattr(value, "item") else value
+
+    def where(self, conditions):
+        """Builds a WHERE clause and its parameters from a list of conditions"""
+        clauses = []
+        params = []
+        for column, operator, value in conditions:
+            col, mark = quote(column), "?"
+            if operator in ("not null", "not_null", "null"):
+                clauses.append(f"{col} IS {'' if operator == 'null' else 'NOT '}NULL")
+                continue
+            if column in self.dates:
+                col, mark = f"datetime({col})", "datetime(?)"
+            values = value if operator in ("between", "in", "not_in") else [value]
+            if operator == "between":
+                values = values[:2]
+                clauses.append(f"{col} BETWEEN {mark} AND {mark}")
+            elif operator == "in":
+                clauses.append(f"{col} IN ({', '.join([mark] * len(values))})")
+            elif operator == "not_in":
+                # Like pandas, missing values are kept, being none of the values
+                marks = ", ".join([mark] * len(values))
+                clauses.append(f"({col} NOT IN ({marks}) OR {col} IS NULL)")
+            elif operator == "ne":
+                values = value[:1]
+                clauses.append(f"({col} != {mark} OR {col} IS NULL)")
+            elif operator in filterutil.COMPARISONS:
+                values = value[:1]
+                clauses.append(f"{col} {filterutil.COMPARISONS[operator]} {mark}")
+            else:
+                clauses.append(f"{col} {operator} {mark}")
+            params.extend(self._param(column, item) for item in values)
+        if not clauses:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    def select(self, conditions=(), columns=None, limit=None):
+        """Loads the rows matching the conditions"""
+        fields = ", ".join(quote(col) for col in columns) if columns else "*"
+        where, params = self.where(conditions)
+        sql = f"SELECT {fields} FROM {quote(self.table)}{where}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return self.query(sql, params)
+
+    def _grouped_sql(self, conditions, keys, columns=None):
+        """SQL summing the numeric columns over groups, like groupby(keys).sum()"""
+        if columns is None:
+            columns = [
+                col
+                for col, dtype in self.dtypes.items()
+                if col not in keys and dtype in ("int64", "float64")
+            ]
+        # Like pandas, rows with a missing key don't belong to any group
+        conditions = conditions + [(key, "not null", None) for key in keys]
+        where, params = self.where(conditions)
+
+        group = ", ".join(quote(key) for key in keys)
+        sums = [f"COALESCE(SUM({quote(col)}), 0) AS {quote(col)}" for col in columns]
+        sql = f"SELECT {', '.join([group] + sums)} FROM {quote(self.table)}{where}"
+        return f"{sql} GROUP BY {group}", params
+
+    def filtered(self, filters):
+        """The rows passing the filters, as bento.util.filter_df selects them"""
+        return self.select(filter_conditions(filters))
+
+    def traces(self, filters, key_columns):
+        """The traces of bento.util.prepare_traces, each from its own query"""
+        traces = []
+        for name, conditions in trace_specs(filters):
+            if key_columns:
+                sql, params = self._grouped_sql(conditions, key_columns)
+                order = ", ".join(quote(key) for key in key_columns)
+                trace = self.query(f"{sql} ORDER BY {order}", params)
+            else:
+                trace = self.select(conditions)
+            trace["label"] = ""
+            trace.name = name
+            traces.append(trace)
+        return traces
+
+    def rank(self, key, text_key, column, count=10, filters=None):
+        """The largest sums of column over the key groups, as in bento.util.rank"""
+        keys = key if isinstance(key, list) else [key]
+        conditions = filter_conditions(filters or {})
+        conditions.append((text_key, "!=", "None"))
+        sql, params = self._grouped_sql(conditions, keys, columns=[column])
+        # Ties keep the group order, like DataFrame.nlargest
+        order = ", ".join(quote(key) for key in keys)
+        sql = f"{sql} ORDER BY {quote(column)} DESC, {order} LIMIT {int(count)}"
+        fdf = self.query(sql, params)
+        return zip(fdf[text_key], fdf[column])
+
+    def aggregate_many(self, reductions, filters, keys):
+        """Reduces the traces of prepare_traces to several values, in a single query
+
+        reductions is a list of (y_column, logic) pairs, as in bento.util.aggregate.
+        Returns None when a reduction has no SQL equivalent, or there are no traces
+        to reduce.
+        """
+        if any(y and logic not in SQL_REDUCTIONS for y, logic in reductions):
+            return None
+        queries = []
+        params = []
+        for _, conditions in trace_specs(filters):
+            if keys:
+                sql, trace_params = self._grouped_sql(conditions, keys)
+            else:
+                where, trace_params = self.where(conditions)
+                sql = f"SELECT * FROM {quote(self.table)}{where}"
+            queries.append(sql)
+            params.extend(trace_params)
+        if not queries:
+            return None
+
+        fields = [
+            f"{SQL_REDUCTIONS[logic]}({quote(y_column)})" if y_column else "COUNT(*)"
+            for y_column, logic in reductions
+        ]
+        traces = " UNION ALL ".join(queries)
+        values = (
+            self.connection()
+            .execute(f"SELECT {', '.join(fields)} FROM ({traces})", params)
+            .fetchone()
+        )
+        return [
+            (0 if logic == "sum" else np.nan) if value is None else value
+            for value, (_, logic) in zip(values, reductions)
+        ]
+
+    @property
+    def columns(self):
+        return pd.Index(self.profile["columns"])
+
+    @property
+    def shape(self):
+        return (self.profile["rows"], len(self.profile["columns"]))
+
+    def __len__(self):
+        return self.profile["rows"]
+
+    def __getitem__(self, key):
+        """Supports selecting a single column or slicing the leading rows"""
+        if isinstance(key, slice):
+            return self.head(key.stop)
+        return self.select(columns=[key])[key]
+
+    def head(self, rows=5):
+        return self.select(limit=rows)
+
+
+def load(
+    filename,
+    table,
+    package="bento",
+    location=".",
+    parse_dates=None,
+    keys=None,
+    profile=False,
+):
+    """Loads a table of a SQLite database as a Bento dataset
+
+    Use it as the "module" of a data entry in the descriptor, giving the database
+    file and table in the "args". The data stays in the database, which runs the
+    filters and aggregations of the app's callbacks.
+
+    keys: list
+        The columns to offer as filters, by default the text columns.
+    profile: bool
+        Return only the profile of the table, as df_loader does.
+    """
+    path = datautil.find_file(filename, package=package, location=location)
+    if path is None:
+        return
+    sql_table = SqlTable(path, table, parse_dates=parse_dates)
+    if keys is None:
+        keys = [col for col, dtype in sql_table.dtypes.items() if dtype == "object"]
+    numeric = {
+        col: int if "int" in dtype else float
+        for col, dtype in sql_table.dtypes.items()
+        if col not in sql_table.dates + keys
+    }
+    data = {
+        "df": sql_table.profile if profile else sql_table,
+        "dates": sql_table.dates,
+        "keys": keys,
+        "columns": list(numeric),
+        "types": numeric,
+    }
+    return data
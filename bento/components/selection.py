@@ -31,16 +31,17 @@ class date_picker(Component):
 class dropdown(Component):
     def __init__(self, options, multi=False, **kwargs):
         args = {**butil.gen_options(options, multi=multi)}
-        if len(args["options"]) > MAX_OPTIONS:
-            if "overflow" in options:
-                args.pop("options")
-                args.pop("value")
-                args["overflow"] = f"butil.gen_options({options['overflow']}, [])"
-            else:
-                logging.warning(
-                    f"Dropdown has many options {len(args['options'])} and"
-                    "might cause performance issues"
-                )
+        many_options = len(args["options"]) > MAX_OPTIONS
+        # An empty list of options means they weren't known when building the app
+        if (many_options or not args["options"]) and "overflow" in options:
+            args.pop("options")
+            args.pop("value")
+            args["overflow"] = f"butil.gen_options({options['overflow']}, [])"
+        elif many_options:
+            logging.warning(
+                f"Dropdown has many options {len(args['options'])} and"
+                "might cause performance issues"
+            )
         super().__init__("dcc", "Dropdown", args, **kwargs)
 
 
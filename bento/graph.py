@@ -6,7 +6,7 @@ import numpy as np
 import plotly.graph_objects as go
 
 from bento import util as butil
-from bento.resources import geojson
+from bento.resources import geometry, geometry_url
 from bento.common import logger, dictutil  # noqa
 
 logging = logger.fancy_logger(__name__)
@@ -37,8 +37,27 @@ class Graph:
         keys=None,
         filters={},
         transforms=[],
+        index=None,
+        cache=None,
+        max_points=5000,
+        webgl_threshold=10000,
+        raster_shape=(300, 400),
+        relayout=None,
         **kwargs,
     ):
+        """A figure of the traces of idf, of one of the normal (non-map) variants
+
+        Scatter traces with more than max_points rows are downsampled to that many
+        (see butil.downsample), and the name of the trace says so; None keeps them
+        all. Bars and histograms always show every row. Scatter figures with more
+        than webgl_threshold points in all are drawn with WebGL (as Scattergl), which
+        stays responsive with many more points than SVG, and the trace names say so;
+        None always uses SVG.
+
+        The raster variant bins the points into a heatmap of raster_shape cells
+        (see butil.raster), so its size doesn't grow with the rows. It covers the
+        ranges zoomed to in relayout, the relayoutData of the graph.
+        """
 
         x_label = x_label or x_column
 
@@ -51,11 +70,15 @@ class Graph:
 
         key_columns = keys if keys is not None else ["date"]
 
-        graph_call = getattr(go, variant.title())
+        if variant == "raster":
+            graph_call = go.Heatmap
+        else:
+            graph_call = getattr(go, variant.title())
 
         fig = go.Figure()
+        trace_settings = []
         if variant in ("pie"):
-            fdf = butil.filter_df(idf, filters)
+            fdf = butil.filter_df(idf, filters, index=index, cache=cache)
             default_settings = {}
             data_settings = {
                 "pie": {"labels": fdf[x_column], "values": fdf[y_column],},
@@ -68,7 +91,7 @@ class Graph:
 
         elif variant == "scatter" and subvariant in ("training"):
             key_columns = keys
-            traces = [butil.filter_df(idf, filters)]
+            traces = [butil.filter_df(idf, filters, index=index, cache=cache)]
 
             for trace_df in traces:
                 for y_column in y_columns:
@@ -93,22 +116,34 @@ class Graph:
 
                     settings = default_settings
                     settings.update(style_settings.get(variant, {}))
-                    fig.add_trace(graph_call(**settings))
+                    trace_settings.append(settings)
 
         elif variant in ("scatter", "bar", "histogram"):
-            traces = butil.prepare_traces(idf, filters, key_columns)
+            traces = butil.prepare_traces(
+                idf, filters, key_columns, index=index, cache=cache
+            )
             traces = butil.trace_analytics(traces, transforms)
-            for trace_df in traces:
+            for full_df in traces:
                 y_idx = 1
                 for y_column in y_columns:
                     yaxis = f"y{y_idx}"
 
+                    trace_df = full_df
+                    name = f"{full_df.name} - {y_column.title()}"
+                    if variant == "scatter":
+                        positions = butil.downsample(
+                            full_df[x_column], full_df[y_column], max_points
+                        )
+                        if positions is not None:
+                            trace_df = full_df.take(positions)
+                            name += f" ({len(positions):,} of {len(full_df):,} points)"
+
                     default_settings = {
                         "x": trace_df[x_column],
                         "y": trace_df[y_column],
                         # TODO Fix up hover info for non-map plots
                         # "text": trace_df["hover_info"],
-                        "name": f"{trace_df.name} - {y_column.title()}",
+                        "name": name,
                     }
 
                     if y_idx > 1:
@@ -139,9 +174,38 @@ class Graph:
                         )
                         settings["text"] = trace_df[color]
 
-                    fig.add_trace(graph_call(**settings))
+                    trace_settings.append(settings)
                     y_idx += 1
 
+        elif variant == "raster":
+            fdf = butil.filter_df(idf, filters, index=index, cache=cache)
+            x_range, y_range = butil.relayout_ranges(relayout)
+            grid, x_centers, y_centers = butil.raster(
+                fdf[x_column], fdf[y_columns[0]], x_range, y_range, raster_shape
+            )
+            # Empty cells are left clear
+            grid[grid == 0] = np.nan
+            hovertemplate = "%{x}, %{y}<br>Count: %{z}<extra></extra>"
+            trace_settings.append(
+                {
+                    "x": x_centers,
+                    "y": y_centers,
+                    "z": grid,
+                    "colorscale": butil.log_color_scale("Viridis", base=3),
+                    "showscale": False,
+                    "hovertemplate": hovertemplate,
+                }
+            )
+
+        if variant == "scatter" and webgl_threshold is not None:
+            points = sum(len(settings["x"]) for settings in trace_settings)
+            if points > webgl_threshold:
+                graph_call = go.Scattergl
+                for settings in trace_settings:
+                    settings["name"] += " (WebGL)"
+        for settings in trace_settings:
+            fig.add_trace(graph_call(**settings))
+
         barmode = mode if mode in ["stack", "group", "relative"] else "stack"
         layout = {
             "margin": {
@@ -176,6 +240,11 @@ class Graph:
         if variant == "pie":
             layout.update({"legend_x": 1, "legend_y": 1})
 
+        if variant == "raster":
+            for axis, axis_range in zip(("xaxis", "yaxis"), (x_range, y_range)):
+                if axis_range is not None:
+                    layout[axis]["range"] = list(axis_range)
+
         if variant == "histogram":
             layout = {
                 "xaxis": {"title": butil.titlize(y_label),},
@@ -200,8 +269,24 @@ class Graph:
         marker_line_width=0,
         marker_line_color="black",
         filters={},
+        cube=None,
+        index=None,
+        cache=None,
+        raster_shape=(300, 400),
+        relayout=None,
         **kwargs,
     ):
+        """A figure of idf on a map, of locations (scatter) or regions (choropleth)
+
+        Choropleths refer to their geojson by URL when the app serves it, or else carry
+        that of just the regions at their locations. Either way, the shapes are
+        simplified for the zoom (see resources.geometry).
+
+        The raster variant bins the locations into a grid of raster_shape cells
+        (see butil.raster), drawing one point per cell that isn't empty, colored by
+        its count (or the sum of z_column). It covers the view in relayout, the
+        relayoutData of the map, and keeps that view.
+        """
         fig = go.Figure()
 
         # First, create the single data trace
@@ -209,7 +294,13 @@ class Graph:
             "marker_opacity": marker_opacity,
             "name": getattr(idf, "name", ""),
         }
-        pdf = butil.filter_df(idf, filters)
+        if variant == "scatter":
+            # Locations are summed, so may come from a rollup of the data
+            locations = ["latitude", "longitude"]
+            rollup = butil.from_cube(idf, cube, filters, locations, grouped=locations)
+            if rollup is not idf:
+                idf, index, cache = rollup, None, None
+        pdf = butil.filter_df(idf, filters, index=index, cache=cache)
 
         if variant == "scatter":
             pdf = pdf.groupby(["latitude", "longitude"]).sum().reset_index()
@@ -221,6 +312,33 @@ class Graph:
                 "marker_size": marker_size,
                 "hovertemplate": hovertemplate,
             }
+        elif variant == "raster":
+            lon_range, lat_range = butil.map_bounds(relayout)
+            weights = pdf[z_column] if z_column else None
+            grid, lons, lats = butil.raster(
+                pdf["longitude"],
+                pdf["latitude"],
+                lon_range,
+                lat_range,
+                raster_shape,
+                weights=weights,
+            )
+            rows, columns = np.nonzero(grid)
+            measure = z_column.title() if z_column else "Count"
+            hovertemplate = f"{measure}: %{{marker.color}}<extra></extra>"
+            args = {
+                **base_args,
+                "lon": lons[columns],
+                "lat": lats[rows],
+                "marker_color": grid[rows, columns],
+                "marker_colorscale": butil.log_color_scale("Viridis", base=3),
+                "marker_size": marker_size,
+                "hovertemplate": hovertemplate,
+            }
+            # Stay on the view zoomed to, rather than going back to the default
+            if "mapbox.center" in (relayout or {}):
+                mapbox_center = relayout["mapbox.center"]
+                mapbox_zoom = relayout.get("mapbox.zoom", mapbox_zoom)
         elif variant == "choropleth":
             # Leading two digits of fips are state code
             if "state" in geo:
@@ -238,13 +356,20 @@ class Graph:
                 loc_column = "alpha3"
                 text = pdf["country"]
 
+            # Points given regions as they loaded (see datautil.add_regions) are
+            # summed into one row per region
+            points = "regions" in getattr(idf, "attrs", {})
+            if points and pdf[loc_column].duplicated().any():
+                keys = [loc_column, text.name]
+                pdf = pdf.groupby(keys, observed=True)[z_column].sum().reset_index()
+                text = pdf[text.name]
+
             ht_title = "<b>%{text}</b>"
             ht_info = f"{z_column.title()}: %{{z:s}}"
             hovertemplate = "<br>".join([ht_title, ht_info])
             args = {
                 **base_args,
                 "z": pdf[z_column],
-                "geojson": geojson[geo],
                 "text": text,
                 "locations": pdf[loc_column],
                 "marker_line_width": marker_line_width,
@@ -254,9 +379,6 @@ class Graph:
                 "hovertemplate": hovertemplate,
             }
 
-        trace = getattr(go, f"{variant.capitalize()}mapbox")(args)
-        fig.add_trace(trace)
-
         if mapbox_center == "default":
             if "us" in geo:
                 mapbox_center = {"lat": 37.0902, "lon": -95.7129}
@@ -278,6 +400,19 @@ class Graph:
                 magnification = min(lat_multiple, lon_multiple)
                 mapbox_zoom = ref_zoom + math.log(magnification, 2)
 
+        if variant == "choropleth":
+            # Shapes in the detail the zoom can show, fetched once by URL where they're
+            # served (see resources.serve_geometry), else just the regions colored
+            args["geojson"] = geometry_url(geo, mapbox_zoom) or geometry(
+                geo, mapbox_zoom, args["locations"]
+            )
+
+        if variant == "raster":
+            trace = go.Scattermapbox(args)
+        else:
+            trace = getattr(go, f"{variant.capitalize()}mapbox")(args)
+        fig.add_trace(trace)
+
         # Now define the layout
         layout = {
             "margin": {"l": 0, "b": 0, "t": 0, "r": 0},
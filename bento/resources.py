@@ -1,9 +1,17 @@
+import collections.abc
+import functools
+import gzip
+import hashlib
 import json
 import pathlib
+import pickle
 import pkgutil
+import threading
 from urllib import request
 
-from bento.common import logger, dictutil  # noqa
+import flask
+
+from bento.common import logger, dictutil, datautil, geoutil  # noqa
 
 logging = logger.fancy_logger(__name__)
 
@@ -11,7 +19,6 @@ logging = logger.fancy_logger(__name__)
 init_py_path = pkgutil.get_loader("bento").path
 package_path = pathlib.Path(init_py_path).parent
 
-geojson = {}
 resource_list = [
     ("us_counties", "geojson_us_counties.json"),
     ("us_states", "geojson_us_states.json"),
@@ -29,21 +36,239 @@ web_backup = {
     ),
 }
 location_list = [".", "assets", f"{package_path}/assets"]
-for uid, resource in resource_list:
-    for loc in location_list:
-        try:
-            with open(f"{loc}/{resource}", "r") as fh:
-                geojson[uid] = json.load(fh)
-            logging.info(f"...Loaded {resource}")
-            break
-        except Exception:
-            continue
-
-    if uid in web_backup and uid not in geojson:
-        logging.info("   Trying web...")
+
+# The columns of the code and name of each region, and the property of the name
+region_columns = {
+    "us_states": ("fips", "state", "name"),
+    "us_counties": ("fips", "county", "NAME"),
+    "world": ("alpha3", "country", "name"),
+}
+
+
+class GeoJSON(collections.abc.MutableMapping):
+    """The geojson resources by uid, each loaded when it's first used
+
+    Nothing is read when the app starts, so apps without maps never pay for their
+    geometry. A resource is read from the first of location_list that has its file,
+    through a binary copy kept next to it (see cached), or else from its web_backup.
+    Other geojson can be added by uid, as to a dict.
+
+    The geojson is plain, with rings as lists, and made from the loaded copy the
+    first time it's asked for. The maps themselves draw on that copy, whose rings
+    are arrays (see geometry and region_index).
+    """
+
+    def __init__(self, resources):
+        self.resources = dict(resources)
+        self._loaded = {}
+        self._plain = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, uid):
+        if uid not in self._plain:
+            shapes = self._shapes(uid)
+            with self._lock:
+                if uid not in self._plain:
+                    self._plain[uid] = geoutil.as_lists(shapes)
+        return self._plain[uid]
+
+    def _shapes(self, uid):
+        """The geojson of uid as loaded, whose rings may be arrays"""
+        if uid not in self._loaded:
+            if uid not in self.resources:
+                raise KeyError(uid)
+            with self._lock:
+                if uid not in self._loaded:
+                    self._loaded[uid] = self._load(uid)
+        if self._loaded[uid] is None:
+            raise KeyError(uid)
+        return self._loaded[uid]
+
+    def __contains__(self, uid):
         try:
-            with request.urlopen(web_backup[uid]) as response:
-                geojson[uid] = json.load(response)
-                logging.info(f"...Loaded {resource} from web")
-        except Exception:
-            logging.warning(f"   ...Failed to load geojson[{uid}]")
+            self._shapes(uid)
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, uid, value):
+        self.resources.pop(uid, None)
+        self._loaded[uid] = value
+        self._plain.pop(uid, None)
+
+    def __delitem__(self, uid):
+        if uid not in self:
+            raise KeyError(uid)
+        self.resources.pop(uid, None)
+        self._loaded.pop(uid, None)
+        self._plain.pop(uid, None)
+
+    def __iter__(self):
+        return iter(dict.fromkeys([*self.resources, *self._loaded]))
+
+    def __len__(self):
+        return len(dict.fromkeys([*self.resources, *self._loaded]))
+
+    def source(self, uid):
+        """The path of the file uid is read from, or None"""
+        if uid not in self.resources:
+            return None
+        for loc in location_list:
+            path = pathlib.Path(loc) / self.resources[uid]
+            if path.is_file():
+                return path
+
+    def _load(self, uid):
+        """Reads uid, or returns None (once, without retrying) if it can't be"""
+        path = self.source(uid)
+        if path is not None:
+            shapes = cached(path, "source", functools.partial(_read, path))
+            logging.info(f"...Loaded {path.name}")
+            return shapes
+        if uid in web_backup:
+            logging.info(f"   Trying web for geojson[{uid}]...")
+            try:
+                with request.urlopen(web_backup[uid]) as response:
+                    shapes = json.load(response)
+                logging.info(f"...Loaded geojson[{uid}] from web")
+                return shapes
+            except Exception:
+                pass
+        logging.warning(f"   ...Failed to load geojson[{uid}]")
+
+
+def _read(path):
+    with open(path, "r") as fh:
+        return json.load(fh)
+
+
+def cached(path, variant, build):
+    """The geojson build() makes from the file at path, kept as a binary copy
+
+    The copy is packed by geoutil.pack_geojson and pickled in datautil.CACHE_DIR next
+    to the file, one per variant, and is remade when the file changes. Its rings
+    load as arrays rather than lists, so a worker reads it in a fraction of the time
+    of parsing the JSON. Where the copy can't be written, build() is just returned.
+    """
+    entry = datautil.cache_location(path, "geojson")
+    target = entry.with_name(f"{entry.name}.{variant}.pickle")
+    try:
+        with open(target, "rb") as fh:
+            return geoutil.unpack_geojson(*pickle.load(fh))
+    except FileNotFoundError:
+        pass
+    except Exception as exc:
+        logging.warning(f"Ignoring the unreadable cache {target}: {exc}")
+
+    packed = geoutil.pack_geojson(build())
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = datautil._tmp_path(target)
+        with open(tmp, "wb") as fh:
+            pickle.dump(packed, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(target)
+        datautil.prune_cache(entry)
+    except OSError as exc:
+        logging.debug(f"Couldn't cache {path.name}: {exc}")
+    return geoutil.unpack_geojson(*packed)
+
+
+geojson = GeoJSON(resource_list)
+
+# The geojson simplified for each zoom level, as it's first needed
+simplified = {}
+
+
+def geometry(uid, zoom=None, locations=None):
+    """The geojson[uid] to draw on a map at zoom, with only the features at locations
+
+    The geometries are simplified for the zoom level showing the map at zoom (see
+    geoutil.zoom_level), or kept whole with their coordinates rounded when zoomed in
+    further. Each level is made once, then kept for every figure after, and cached
+    next to the source file for the processes that follow.
+    """
+    level = geoutil.zoom_level(zoom)
+    if (uid, level) not in simplified:
+        build = functools.partial(_simplify, uid, level)
+        path = geojson.source(uid)
+        shapes = cached(path, f"zoom{level}", build) if path else build()
+        simplified[(uid, level)] = shapes
+    shapes = simplified[(uid, level)]
+    if locations is not None:
+        shapes = geoutil.select_features(shapes, locations)
+    return shapes
+
+
+# The path browsers fetch the geometries from, see serve_geometry
+geometry_route = None
+
+# The geometries as served, with their ETag, gzipped too
+payloads = {}
+
+
+def serve_geometry(app, route="_bento/geojson", max_age=365 * 24 * 3600):
+    """Serves the geometries from a route of the Dash app, for maps to fetch once
+
+    Maps then refer to their geometry by URL (see geometry_url), rather than carrying
+    it in every figure. The URL holds the ETag of the geometry, so browsers can keep
+    it for max_age seconds, and still revalidate with the ETag when asked. Like the
+    routes of Dash itself, the route follows the routes_pathname_prefix of the app,
+    and the URLs its requests_pathname_prefix, so apps served under a path work.
+    """
+    global geometry_route
+    levels = {str(level): level for level in geoutil.ZOOM_LEVELS}
+    levels["full"] = None
+
+    def send_geometry(uid, level):
+        if uid not in geojson or level not in levels:
+            flask.abort(404)
+        body, compressed, etag = geometry_payload(uid, levels[level])
+        encodings = flask.request.headers.get("Accept-Encoding", "")
+        response = flask.Response(
+            compressed if "gzip" in encodings else body, mimetype="application/json"
+        )
+        if "gzip" in encodings:
+            response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response.make_conditional(flask.request)
+
+    rule = f"{app.config.routes_pathname_prefix}{route}/<uid>/<level>.json"
+    app.server.add_url_rule(rule, "bento_geometry", send_geometry)
+    geometry_route = f"{app.config.requests_pathname_prefix}{route}"
+
+
+def _simplify(uid, level):
+    logging.info(f"Simplifying geojson[{uid}] for zoom {level}")
+    return geoutil.simplify_geojson(geojson._shapes(uid), level)
+
+
+def geometry_payload(uid, level):
+    """The JSON of the geojson[uid] at a zoom level, gzipped, and its ETag"""
+    if (uid, level) not in payloads:
+        body = geoutil.to_json(geometry(uid, zoom=level)).encode()
+        etag = hashlib.sha1(body).hexdigest()[:16]
+        payloads[(uid, level)] = (body, gzip.compress(body), etag)
+    return payloads[(uid, level)]
+
+
+def geometry_url(uid, zoom=None):
+    """The URL of the geometry of uid for a map at zoom, or None if it isn't served"""
+    if geometry_route is None or uid not in geojson:
+        return None
+    level = geoutil.zoom_level(zoom)
+    etag = geometry_payload(uid, level)[2]
+    return f"{geometry_route}/{uid}/{level or 'full'}.json?v={etag}"
+
+
+# The spatial index of each geojson, as it's first needed
+region_indexes = {}
+
+
+def region_index(uid):
+    """A geoutil.RegionIndex of the regions of geojson[uid], made once"""
+    if uid not in region_indexes:
+        region_indexes[uid] = geoutil.RegionIndex(geojson._shapes(uid))
+    return region_indexes[uid]
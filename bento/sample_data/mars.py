@@ -3,10 +3,10 @@ from bento.common import logger, datautil
 logging = logger.fancy_logger(__name__)
 
 
-def load():
+def load(**kwargs):
     filename = "sample_mars_data.csv"
     data = {
-        "df": datautil.df_loader(filename, parse_dates=False),
+        "df": datautil.df_loader(filename, parse_dates=False, **kwargs),
         "keys": ["region", "city"],
         "types": {"date": "date", "population": int, "energy_consumption": float,},
     }
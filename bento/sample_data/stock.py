@@ -3,10 +3,10 @@ from bento.common import logger, datautil
 logging = logger.fancy_logger(__name__)
 
 
-def load():
+def load(**kwargs):
     filename = "sample_stock_data.csv"
     data = {
-        "df": datautil.df_loader(filename, parse_dates=["date"]),
+        "df": datautil.df_loader(filename, parse_dates=["date"], **kwargs),
         "keys": ["symbol"],
         "types": {
             "open": float,
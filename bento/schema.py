@@ -19,6 +19,7 @@ page_schema = {
                 "type": {"type": "string", "required": True, "regex": bento_uid_regex},
                 "width": {"type": "integer"},
                 "args": {"type": "dict"},
+                "executor": {"type": "string", "allowed": ["inline", "process"]},
             },
         },
     },
@@ -43,6 +44,7 @@ descriptor_schema = {
         },
     },
     "data": {"type": "dict"},
+    "load_workers": {"type": "integer", "min": 1},
     "show_help": {"type": "boolean"},
     "pages": {
         "type": "dict",
@@ -0,0 +1,347 @@
+import threading
+from concurrent import futures
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import bento.util as butil
+from bento.common import datautil
+
+
+def write_csv(tmp_path):
+    df = pd.DataFrame(
+        {
+            "date": ["2020-01-01", "2020-01-02", "2020-01-03"],
+            "state": ["Texas", "Ohio", "Texas"],
+            "cases": [1, 2, 3],
+            "rate": [0.5, None, 1.5],
+        }
+    )
+    df.to_csv(tmp_path / "sample.csv", index=False)
+    return "sample.csv"
+
+
+def test_cache_roundtrip(tmp_path):
+    filename = write_csv(tmp_path)
+    cold = datautil.df_loader(filename, parse_dates=["date"], location=tmp_path)
+    assert len(list((tmp_path / datautil.CACHE_DIR).iterdir())) == 1
+    warm = datautil.df_loader(filename, parse_dates=["date"], location=tmp_path)
+    pd.testing.assert_frame_equal(cold, warm)
+
+
+def test_cache_invalidation(tmp_path):
+    filename = write_csv(tmp_path)
+    datautil.df_loader(filename, location=tmp_path)
+    with open(tmp_path / filename, "a") as fh:
+        fh.write("2020-01-04,Utah,4,2.5\n")
+    df = datautil.df_loader(filename, location=tmp_path)
+    assert len(df) == 4
+    # The stale entry is replaced rather than accumulating
+    assert len(list((tmp_path / datautil.CACHE_DIR).iterdir())) == 1
+    # Entries with other load args for the same source are kept
+    datautil.df_loader(filename, location=tmp_path, compact=True)
+    entries = set((tmp_path / datautil.CACHE_DIR).iterdir())
+    assert len(entries) == 2
+    datautil.df_loader(filename, location=tmp_path)
+    assert set((tmp_path / datautil.CACHE_DIR).iterdir()) == entries
+
+
+def test_mmap_shares_columns(tmp_path):
+    filename = write_csv(tmp_path)
+    private = datautil.df_loader(filename, parse_dates=["date"], location=tmp_path)
+    shared = datautil.df_loader(
+        filename, parse_dates=["date"], location=tmp_path, mmap=True
+    )
+    pd.testing.assert_frame_equal(private, shared)
+    mapped = shared["cases"].to_numpy()
+    assert not mapped.flags.writeable
+    # Filtering must not trigger a private copy of the mapped arrays
+    subset = shared[shared["cases"] > 1]
+    assert len(subset) == 2
+    assert np.shares_memory(shared["cases"].to_numpy(), mapped)
+
+
+def test_read_columns_without_internals(tmp_path, monkeypatch):
+    filename = write_csv(tmp_path)
+    df = datautil.df_loader(
+        filename, parse_dates=["date"], location=tmp_path, compact=True
+    )
+    entry = next((tmp_path / datautil.CACHE_DIR).iterdir())
+    monkeypatch.setattr(datautil, "BlockManager", None)
+    pd.testing.assert_frame_equal(datautil.read_columns(entry, mmap=True), df)
+
+
+def test_profile_matches_frame(tmp_path):
+    filename = write_csv(tmp_path)
+    df = datautil.df_loader(filename, parse_dates=["date"], location=tmp_path)
+    expected = datautil.profile_df(df)
+    # The first call streams the CSV, the second reads the cached sidecar
+    for _ in range(2):
+        profile = datautil.df_loader(
+            filename, parse_dates=["date"], location=tmp_path, profile=True
+        )
+        assert profile["rows"] == 3
+        assert profile["dtypes"] == expected["dtypes"]
+        assert list(profile["uniques"]["state"]) == ["Ohio", "Texas"]
+        assert profile["min"]["date"] == expected["min"]["date"]
+        assert profile["max"]["rate"] == 1.5
+
+
+def test_profile_cap():
+    df = pd.DataFrame({"value": range(10)})
+    profile = datautil.profile_df(df, cap=5)
+    assert profile["uniques"]["value"] is None
+    assert (profile["min"]["value"], profile["max"]["value"]) == (0, 9)
+
+
+def test_compact_df():
+    df = pd.DataFrame(
+        {"state": ["Texas", "Ohio"] * 50, "id": [str(i) for i in range(100)]}
+    )
+    df["cases"] = range(100)
+    df["rate"] = 0.5
+    compact = datautil.compact_df(df, float32=True)
+    assert compact["state"].dtype == "category"
+    assert compact["id"].dtype == object
+    assert compact["cases"].dtype == "int8"
+    assert compact["rate"].dtype == "float32"
+    pd.testing.assert_frame_equal(
+        df, compact, check_dtype=False, check_categorical=False
+    )
+
+
+def test_partitions(tmp_path):
+    filename = write_csv(tmp_path)
+    df = datautil.df_loader(filename, parse_dates=["date"], location=tmp_path)
+    parts = datautil.df_loader(
+        filename, parse_dates=["date"], location=tmp_path, chunksize=2
+    )
+    assert len(parts.paths) == 2
+    assert parts.shape == df.shape
+    pd.testing.assert_frame_equal(pd.concat(parts), df, check_index_type=False)
+    assert datautil.profile_df(parts)["rows"] == 3
+
+
+def test_partitions_outlive_other_loads(tmp_path):
+    filename = write_csv(tmp_path)
+    parts = datautil.df_loader(filename, location=tmp_path, chunksize=2)
+    datautil.df_loader(filename, location=tmp_path, compact=True)
+    with open(tmp_path / filename, "a") as fh:
+        fh.write("2020-01-04,Utah,4,2.5\n")
+    datautil.df_loader(filename, location=tmp_path)
+    fdf = butil.filter_df(parts, butil.prepare_filters({"state_filter": "Texas"}))
+    assert list(fdf["cases"]) == [1, 3]
+
+
+def test_load_datasets():
+    loaders = {"a": lambda: {"df": 1}, "b": lambda: {"df": 2}}
+    data = datautil.load_datasets(loaders, workers=2)
+    assert list(data) == ["a", "b"]
+    assert data["b"]["df"] == 2
+
+
+def test_refresh_appends(tmp_path):
+    filename = write_csv(tmp_path)
+    compact = {"keys": ["state"]}
+    for args in ({"mmap": True, "compact": compact}, {"chunksize": 2}):
+        data = {"df": datautil.df_loader(filename, location=tmp_path, **args)}
+        assert datautil.refresh(data) == 0
+        with open(tmp_path / filename, "a") as fh:
+            fh.write("2020-01-04,Utah,4,2.5\n2020-01-05,Oh")
+        assert datautil.refresh(data) == 1
+        assert data["version"] == 1
+        df = pd.concat(data["df"]) if "chunksize" in args else data["df"]
+        assert list(df["state"]) == ["Texas", "Ohio", "Texas", "Utah"]
+        assert df["cases"].iloc[-1] == 4
+        assert len(data["df"]) == 4
+        # The partial line is picked up once it is complete
+        with open(tmp_path / filename, "a") as fh:
+            fh.write("io,5,3.5\n")
+        assert datautil.refresh(data) == 1
+        assert data["df"].shape == (5, 4)
+        write_csv(tmp_path)
+
+
+def test_regions_at_load(tmp_path):
+    points = pd.DataFrame(
+        {
+            "latitude": [30.27, 39.96, 30.1, 48.85],
+            "longitude": [-97.74, -83.0, -97.5, 2.35],
+            "count": [1, 2, 3, 4],
+        }
+    )
+    points.to_csv(tmp_path / "points.csv", index=False)
+    regions = {"us_states": "state_fips", "us_counties": "fips"}
+    for _ in range(2):
+        df = datautil.df_loader("points.csv", location=tmp_path, regions=regions)
+        assert list(df["state_fips"]) == ["48", "39", "48", np.nan]
+        assert list(df["state"])[:2] == ["Texas", "Ohio"]
+        assert list(df["fips"])[:2] == ["48453", "39049"]
+        assert list(df["county"])[:2] == ["Travis", "Franklin"]
+    profile = datautil.df_loader(
+        "points.csv", location=tmp_path, regions=regions, profile=True
+    )
+    assert {"state_fips", "county"} <= set(profile["columns"])
+    # Appended rows are located too
+    data = {"df": df}
+    with open(tmp_path / "points.csv", "a") as fh:
+        fh.write("40.71,-74.0,5\n")
+    assert datautil.refresh(data) == 1
+    assert data["df"]["state"].iloc[-1] == "New York"
+    # States and counties both put their codes in fips, unless told otherwise
+    with pytest.raises(ValueError, match="fips"):
+        datautil.add_regions(points, ["us_states", "us_counties"])
+
+
+def test_cube_rollups():
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2020-01-01", "2020-01-02"] * 3),
+            "state": ["Texas", "Texas", "Ohio", "Ohio", "Utah", "Utah"],
+            "county": ["a", "a", "b", "c", "d", "d"],
+            "cases": [1, 2, 3, 4, 5, 6],
+        }
+    )
+    data = {"df": df, "keys": ["state", "county"]}
+    datautil.add_cube(data)
+    cube = data["cube"]
+    assert len(cube.rollups) == 7
+    rollup = cube.lookup(["state", "cases"])
+    assert list(rollup["cases"]) == [7, 3, 11]
+    assert len(cube.lookup(["date", "state"])) == 6
+    assert cube.lookup(["cases", "deaths"]) is None
+
+    rows = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2020-01-03"]),
+            "state": ["Ohio"],
+            "county": ["b"],
+            "cases": [10],
+        }
+    )
+    cube = cube.append(rows)
+    assert list(cube.lookup(["state"])["cases"]) == [17, 3, 11]
+
+
+def test_sorted_range_filter(tmp_path):
+    filename = write_csv(tmp_path)
+    with open(tmp_path / filename, "a") as fh:
+        fh.write("2020-01-02,Utah,4,2.5\n")
+    df = datautil.df_loader(
+        filename, parse_dates=["date"], location=tmp_path, sort="date", mmap=True
+    )
+    assert list(df["state"]) == ["Texas", "Ohio", "Utah", "Texas"]
+    bounds = [pd.Timestamp("2020-01-02").value] * 2
+    fdf = butil.filter_df(df, {"between": {"date": bounds}})
+    assert list(fdf["cases"]) == [2, 4]
+    # The range is a slice of the mapped columns, not a copy
+    assert np.shares_memory(fdf["cases"].to_numpy(), df["cases"].to_numpy())
+
+
+def test_inverted_index():
+    df = pd.DataFrame(
+        {
+            "state": ["Texas", "Ohio", "Texas", "Utah", "Ohio"],
+            "county": ["a", "b", "c", "d", "b"],
+            "cases": [1, 2, 3, 4, 5],
+        }
+    )
+    data = {"df": df, "keys": ["state", "county"]}
+    datautil.add_index(data)
+    index = data["index"]
+    assert list(index.lookup("state", ["Texas", "Utah", "Iowa"])) == [0, 2, 3]
+    assert list(index.select([("state", ["Ohio"]), ("county", ["b", "c"])])) == [1, 4]
+    filters = {"or": {"state": ["Texas", "Ohio"]}, "and": {"county": ["b", "c"]}}
+    pd.testing.assert_frame_equal(
+        butil.filter_df(df, filters, index=index), butil.filter_df(df, filters)
+    )
+
+    index = index.append(pd.DataFrame({"state": ["Ohio"], "county": ["e"]}))
+    assert index.rows == 6
+    assert list(index.lookup("state", ["Ohio"])) == [1, 4, 5]
+
+
+def test_group_totals_rank():
+    df = pd.DataFrame(
+        {
+            "state": ["Texas", "Ohio", "Texas", "Utah", "Ohio", "Utah", "Ohio"],
+            "county": ["a", "b", "c", "None", "b", "e", "f"],
+            "cases": [1, 2, 3, 40, 5, 3, 6],
+        }
+    )
+    data = {"df": df}
+    totals = datautil.group_totals(data)
+    assert datautil.group_totals(data) is totals
+    for states in ([], ["Ohio"], ["Ohio", "Texas"], ["Utah", "Texas", "Ohio"]):
+        filters = butil.prepare_filters({"state_filter": states})
+        for count in (2, 3, 10):
+            expected = butil.rank(df, "county", "county", "cases", count, filters)
+            ranked = butil.rank(
+                df, "county", "county", "cases", count, filters, totals=totals
+            )
+            assert list(ranked) == list(expected)
+
+    # Replacing the frame gives new totals
+    data["df"] = df.iloc[:3]
+    assert datautil.group_totals(data).rows == 3
+
+
+def test_frame_cache():
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2020-01-01", "2020-01-02"] * 3),
+            "state": ["Texas", "Texas", "Ohio", "Ohio", "Utah", "Utah"],
+            "cases": range(6),
+        }
+    )
+    data = {"df": df}
+    cache = datautil.frame_cache(data)
+    filters = butil.prepare_filters({"state_filter": ["Ohio", "Utah"]})
+    rows = butil.filter_df(df, filters, cache=cache)
+    pd.testing.assert_frame_equal(rows, butil.filter_df(df, filters))
+    reordered = {"or": {"state": ["Ohio", "Utah"]}}
+    assert butil.filter_df(df, reordered, cache=cache) is rows
+
+    traces = butil.prepare_traces(df, filters, ["date"], cache=cache)
+    again = butil.prepare_traces(df, filters, ["date"], cache=cache)
+    assert [trace.name for trace in again] == [" Ohio", " Utah"]
+    for trace, other in zip(traces, again):
+        assert trace is not other
+        pd.testing.assert_frame_equal(trace, other)
+    # The traces follow the order of the filters, so reordered ones aren't shared
+    cdf = df.assign(county=["a", "a", "b", "b", "c", "c"])
+    inputs = {"state_filter": "Ohio", "county_filter": "c"}
+    for order in (inputs, dict(reversed(inputs.items()))):
+        filters = butil.prepare_filters(order)
+        expected = butil.prepare_traces(cdf, filters, ["date"])
+        traces = butil.prepare_traces(cdf, filters, ["date"], cache=cache)
+        assert [trace.name for trace in traces] == [trace.name for trace in expected]
+
+    # Concurrent callbacks wait for the first to compute a frame
+    calls = []
+    started, release = threading.Event(), threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return df.iloc[:2]
+
+    first = threading.Thread(target=cache.get, args=("key", compute))
+    first.start()
+    started.wait()
+    waiting = futures.ThreadPoolExecutor(1).submit(cache.get, "key", compute)
+    release.set()
+    first.join()
+    assert waiting.result() is cache.get("key", compute)
+    assert len(calls) == 1
+
+    # The least recent frames are dropped to stay within the size
+    datautil.add_frame_cache(data, max_mb=df.memory_usage().sum() * 1.5 / 2 ** 20)
+    cache = datautil.frame_cache(data)
+    cache.get("all", lambda: df)
+    cache.get("some", lambda: df.iloc[:3])
+    assert cache.get("all", lambda: df.copy()) is not df
+    data["version"] = 1
+    assert datautil.frame_cache(data) is not cache
@@ -0,0 +1,48 @@
+import os
+import time
+from concurrent import futures
+
+import pandas as pd
+import pytest
+
+from bento.common import datautil, executil
+
+_data = {}
+
+
+def total(column):
+    return os.getpid(), int(_data["numbers"]["df"][column].sum())
+
+
+def slow(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+@pytest.mark.skipif(not executil.can_fork(), reason="Needs forked processes")
+def test_run_in_process(tmp_path):
+    pd.DataFrame({"value": range(10)}).to_csv(tmp_path / "numbers.csv", index=False)
+    _data["numbers"] = {"df": datautil.df_loader("numbers.csv", location=tmp_path)}
+    # Without a pool, callbacks run inline
+    assert executil.run_in_process(total, "value", data=_data)[0] == os.getpid()
+
+    executil.start_pool(_data, workers=1)
+    pid, result = executil.run_in_process(total, "value", data=_data)
+    assert pid != os.getpid()
+    assert result == 45
+
+    # The workers read the rows a refresh appends for themselves
+    with open(tmp_path / "numbers.csv", "a") as fh:
+        fh.write("10\n")
+    datautil.refresh(_data["numbers"])
+    assert executil.run_in_process(total, "value", data=_data) == (pid, 55)
+
+    # Functions defined after the workers forked run here, leaving the pool working
+    exec("def late():\n    return os.getpid()", globals())
+    assert executil.run_in_process(globals()["late"], data=_data) == os.getpid()
+    assert executil.run_in_process(total, "value", data=_data) == (pid, 55)
+
+    # A worker that doesn't answer in time fails the callback, not running it again
+    with pytest.raises(futures.TimeoutError):
+        executil.run_in_process(slow, 0.5, data=_data, timeout=0.1)
+    executil.reset_pool()
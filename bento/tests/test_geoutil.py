@@ -0,0 +1,118 @@
+import json
+
+import dash
+import numpy as np
+
+from bento import resources
+from bento.common import geoutil
+
+
+def test_douglas_peucker():
+    points = np.array([[0, 0], [1, 0.01], [2, -0.01], [3, 5], [4, 6.01], [5, 7]])
+    keep = geoutil.douglas_peucker(points, 0.1)
+    assert keep.tolist() == [True, False, True, True, False, True]
+    # Rings start and end on the same point
+    ring = np.array([[0, 0], [1, 0], [1, 1], [0.5, 1.001], [0, 1], [0, 0]])
+    keep = geoutil.douglas_peucker(ring, 0.01)
+    assert keep.tolist() == [True, True, True, False, True, True]
+
+
+def test_region_index():
+    square = [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]]
+    hole = [[1, 1], [3, 1], [3, 3], [1, 3], [1, 1]]
+    collection = {
+        "type": "FeatureCollection",
+        "features": [
+            {"id": "a", "geometry": {"type": "Polygon", "coordinates": [square, hole]}},
+            {
+                "id": "b",
+                "geometry": {
+                    "type": "MultiPolygon",
+                    # The second part isn't closed, as some sources leave them
+                    "coordinates": [[hole], [[[5, 0], [6, 0], [6, 1], [5, 1]]]],
+                },
+            },
+        ],
+    }
+    index = geoutil.RegionIndex(collection)
+    lons = [0.5, 2, 5.5, 7, np.nan, 3.5]
+    lats = [0.5, 2, 0.5, 7, 1.0, 2.0]
+    located = index.locate(lons, lats, chunk=4)
+    assert [index.ids[idx] if idx >= 0 else None for idx in located] == [
+        "a",
+        "b",
+        "b",
+        None,
+        None,
+        "a",
+    ]
+
+
+def test_packed_geojson(tmp_path):
+    whole = resources._read(resources.geojson.source("us_states"))
+    unpacked = geoutil.unpack_geojson(*geoutil.pack_geojson(whole))
+    assert json.loads(geoutil.to_json(unpacked)) == whole
+
+    # Resources are read on first use, through a binary copy made then
+    path = tmp_path / "shapes.json"
+    path.write_text(json.dumps(whole))
+    shapes = resources.GeoJSON([("shapes", str(path))])
+    assert list(shapes) == ["shapes"] and not shapes._loaded
+    assert "shapes" in shapes and shapes._loaded
+    calls = []
+    build = lambda: calls.append(1) or resources._read(path)  # noqa: E731
+    first = resources.cached(path, "test", build)
+    second = resources.cached(path, "test", build)
+    assert calls == [1]
+    assert geoutil.to_json(first) == geoutil.to_json(second)
+    assert "missing" not in shapes
+    # The mapping holds plain geojson, though it's loaded with rings as arrays
+    assert json.loads(json.dumps(shapes["shapes"])) == whole
+    assert geoutil.as_lists(first) == whole
+
+
+def test_simplified_geometry():
+    whole = resources.geojson["us_states"]
+    assert resources.geometry("us_states", zoom=3.5) is resources.geometry(
+        "us_states", zoom=3
+    )
+    # The rings of cached geometries are arrays, which to_json turns into lists
+    shapes = json.loads(geoutil.to_json(resources.geometry("us_states", zoom=3)))
+    assert len(shapes["features"]) == len(whole["features"])
+    detailed = resources.geometry("us_states", zoom=12)
+    assert len(geoutil.to_json(shapes)) < len(geoutil.to_json(detailed))
+    for feature in shapes["features"]:
+        geometry = feature["geometry"]
+        polygons = geometry["coordinates"]
+        if geometry["type"] == "Polygon":
+            polygons = [polygons]
+        for ring in (ring for polygon in polygons for ring in polygon):
+            assert len(ring) >= 4 and ring[0] == ring[-1]
+            assert all(round(x, 5) == x for x, _ in ring)
+
+    # Ids are matched as strings, so 6 isn't "06", as with plotly
+    selected = resources.geometry("us_states", zoom=3, locations=["06", "01", 6, "9"])
+    assert [feature["id"] for feature in selected["features"]] == ["01", "06"]
+
+
+def test_served_geometry():
+    # Apps can be served under a path, which the URLs must follow
+    app = dash.Dash(__name__, url_base_pathname="/maps/")
+    app.layout = dash.html.Div()
+    resources.serve_geometry(app)
+    try:
+        url = resources.geometry_url("us_states", zoom=3)
+        assert url.startswith("/maps/_bento/geojson/us_states/")
+        client = app.server.test_client()
+        response = client.get(url)
+        assert response.status_code == 200
+        shapes = resources.geometry("us_states", zoom=3)
+        assert response.json == json.loads(geoutil.to_json(shapes))
+        assert response.cache_control.max_age > 0
+        # The browser revalidates with the ETag, which is also part of the URL
+        etag = response.headers["ETag"]
+        assert etag.strip('"') in url
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+        assert client.get("/maps/_bento/geojson/us_states/3.json").status_code == 404
+    finally:
+        resources.geometry_route = None
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from bento.graph import Graph
+
+
+def test_webgl_above_threshold():
+    df = pd.DataFrame(
+        {"date": pd.date_range("2020-01-01", periods=600, freq="H"), "cases": 1.0}
+    )
+    df["state"] = ["Texas", "Ohio"] * 300
+    inputs = {"x_column": "date", "y_column": "cases", "mode": "lines", "line_width": 2}
+    filters = {"or": {"state": ["Texas", "Ohio"]}}
+    figure = Graph.normal(df, filters=filters, webgl_threshold=500, **inputs)
+    # The threshold applies to the points of the whole figure, not each trace
+    assert [trace.type for trace in figure.data] == ["scattergl", "scattergl"]
+    assert figure.data[0].name.endswith(" (WebGL)")
+    assert figure.data[0].mode == "lines" and figure.data[0].line.width == 2
+    figure = Graph.normal(df, filters=filters, webgl_threshold=None, **inputs)
+    assert [trace.type for trace in figure.data] == ["scatter", "scatter"]
+    # Ordinary line charts stay SVG by default
+    figure = Graph.normal(df, filters=filters, **inputs)
+    assert [trace.type for trace in figure.data] == ["scatter", "scatter"]
+    figure = Graph.normal(df, variant="bar", webgl_threshold=500, **inputs)
+    assert figure.data[0].type == "bar"
+
+
+def test_raster_independent_of_rows():
+    df = pd.DataFrame({"x": range(10000), "y": [i % 100 for i in range(10000)]})
+    inputs = {"x_column": "x", "y_column": "y", "raster_shape": (10, 20)}
+    figure = Graph.normal(df, variant="raster", **inputs)
+    assert figure.data[0].type == "heatmap"
+    assert figure.data[0].z.shape == (10, 20)
+    relayout = {"xaxis.range[0]": 0, "xaxis.range[1]": 999}
+    figure = Graph.normal(df, variant="raster", relayout=relayout, **inputs)
+    assert list(figure.layout.xaxis.range) == [0, 999]
+    assert figure.data[0].z.shape == (10, 20)
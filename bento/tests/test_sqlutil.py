@@ -0,0 +1,81 @@
+import sqlite3
+
+import pandas as pd
+
+import bento.util as butil
+from bento.common import sqlutil
+
+
+def write_db(tmp_path):
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2020-01-01", "2020-01-02", "2020-01-02"] * 2),
+            "state": ["Texas", "Ohio", "Texas", "Utah", "Ohio", None],
+            "cases": [1, 2, 3, 4, 5, 6],
+            "rate": [0.5, None, 1.5, 2.0, 2.5, 3.0],
+        }
+    )
+    with sqlite3.connect(tmp_path / "sample.db") as connection:
+        df.to_sql("cases", connection, index=False)
+    return df
+
+
+def test_load_profile(tmp_path):
+    df = write_db(tmp_path)
+    data = sqlutil.load("sample.db", "cases", location=tmp_path)
+    table = data["df"]
+    assert data["keys"] == ["state"]
+    assert data["types"] == {"cases": int, "rate": float}
+    assert table.shape == df.shape
+    assert list(table.profile["uniques"]["state"]) == ["Ohio", "Texas", "Utah"]
+    assert table.profile["max"]["date"] == df["date"].max()
+    pd.testing.assert_frame_equal(table[:2], df[:2])
+
+
+def test_pushdown_matches_pandas(tmp_path):
+    df = write_db(tmp_path)
+    table = sqlutil.load("sample.db", "cases", location=tmp_path)["df"]
+    inputs = {
+        "state_filter": ["Texas", "Ohio"],
+        "date_filter": [pd.Timestamp("2020-01-02").value] * 2,
+    }
+    filters = butil.prepare_filters(inputs)
+
+    pd.testing.assert_frame_equal(
+        butil.filter_df(table, filters),
+        butil.filter_df(df, filters).reset_index(drop=True),
+    )
+    expected = butil.prepare_traces(df.copy(), filters, ["date"])
+    traces = butil.prepare_traces(table, filters, ["date"])
+    assert [trace.name for trace in traces] == [trace.name for trace in expected]
+    for trace, trace_df in zip(traces, expected):
+        pd.testing.assert_frame_equal(
+            trace[["date", "cases", "rate"]], trace_df[["date", "cases", "rate"]]
+        )
+    for logic in ("sum", "mean", "max"):
+        assert butil.aggregate(table, "cases", filters, logic) == butil.aggregate(
+            df.copy(), "cases", filters, logic
+        )
+    assert butil.aggregate(table, None, filters) == butil.aggregate(
+        df.copy(), None, filters
+    )
+    specs = [{"y_column": "rate", "logic": "max"}, {"y_column": "cases"}, {}]
+    assert butil.aggregate_many(table, specs, filters) == butil.aggregate_many(
+        df.copy(), specs, filters
+    )
+
+    for filters in (
+        {"not_in": {"state": ["Utah"]}, "ge": {"cases": [2]}},
+        {"null": {"rate": []}},
+        {"ne": {"rate": [2.0]}, "or": {"state": ["Texas", "Ohio"]}},
+    ):
+        pd.testing.assert_frame_equal(
+            butil.filter_df(table, filters),
+            butil.filter_df(df, filters).reset_index(drop=True),
+        )
+        assert butil.aggregate(table, "cases", filters) == butil.aggregate(
+            df.copy(), "cases", filters
+        )
+
+    ranked = butil.rank(table, ["state"], "state", "cases", count=2)
+    assert list(ranked) == list(butil.rank(df, ["state"], "state", "cases", count=2))
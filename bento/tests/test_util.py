@@ -0,0 +1,178 @@
+import pandas as pd
+
+import bento.util as butil
+from bento.common import datautil
+
+
+def test_split_traces_match_slicing():
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2020-01-01", "2020-01-02"] * 4),
+            "state": ["Texas", "Texas", "Ohio", "Ohio", "Utah", "Utah", "Ohio", "Iowa"],
+            "county": ["a", "a", "b", "b", "c", "c", "d", "e"],
+            "cases": range(8),
+        }
+    )
+    inputs = {"state_filter": ["Ohio", "Texas", "Ohio", "Maine"], "county_filter": "b"}
+    filters = butil.prepare_filters(inputs)
+    for keys in (["date"], None):
+        expected = butil._sliced_traces(df.copy(), filters, keys)
+        traces = butil.prepare_traces(df.copy(), filters, keys)
+        assert [trace.name for trace in traces] == [
+            " Ohio",
+            " Texas",
+            " Ohio",
+            " Maine",
+            " b",
+        ]
+        assert [trace.name for trace in traces] == [trace.name for trace in expected]
+        for trace, sliced in zip(traces, expected):
+            pd.testing.assert_frame_equal(trace, sliced, check_index_type=False)
+    # Repeated selections must not share a frame
+    assert traces[0] is not traces[2]
+
+
+def test_trace_analytics_match_loop():
+    traces = []
+    for length, offset in ((6, 0), (4, 2), (5, 1)):
+        trace = pd.DataFrame(
+            {"cases": [(3 * i + offset) % 7 for i in range(length)]},
+            index=range(offset, offset + length),
+        )
+        trace.name = f"trace {offset}"
+        traces.append(trace)
+    originals = [trace.copy() for trace in traces]
+    for inputs in (
+        {"w_window_transform": 2, "c_calc_transform": "Rate"},
+        {"c_calc_transform": "Cumulative", "n_norm_transform": "Max"},
+        {"c_calc_transform": "Acceleration", "n_norm_transform": "Other Series"},
+    ):
+        transforms = butil.prepare_transforms({"y_column": "cases", **inputs})
+        expected = butil._looped_analytics(traces, transforms)
+        result = butil.trace_analytics(traces, transforms)
+        assert [trace.name for trace in result] == [trace.name for trace in expected]
+        for trace, looped in zip(result, expected):
+            pd.testing.assert_frame_equal(trace, looped, check_exact=True)
+    # The traces passed in are left as they were
+    for trace, original in zip(traces, originals):
+        pd.testing.assert_frame_equal(trace, original)
+
+
+def test_downsample_keeps_extremes():
+    values = [0.0] * 1000
+    values[123], values[789] = 50.0, -50.0
+    x = pd.Series(pd.date_range("2020-01-01", periods=1000, freq="H"))
+    y = pd.Series(values)
+    positions = butil.downsample(x, y, 20)
+    assert len(positions) == 20
+    assert positions[0] == 0 and positions[-1] == 999
+    assert (positions[1:] > positions[:-1]).all()
+    assert {123, 789} <= set(positions)
+    # Traces within the budget are left whole, and x out of order is strided
+    assert butil.downsample(x, y, 1000) is None
+    assert list(butil.downsample(x[::-1], y, 4)) == [0, 333, 666, 999]
+
+
+def test_raster_zoom():
+    x = pd.Series(pd.date_range("2020-01-01", periods=100, freq="D"))
+    y = pd.Series([float(i % 10) for i in range(100)])
+    grid, x_centers, y_centers = butil.raster(x, y, shape=(5, 4))
+    assert grid.shape == (5, 4) and grid.sum() == 100
+    assert x_centers.dtype.kind == "M" and len(y_centers) == 5
+    relayout = {
+        "xaxis.range[0]": "2020-01-11",
+        "xaxis.range[1]": "2020-01-30",
+        "yaxis.range": [0, 4],
+    }
+    x_range, y_range = butil.relayout_ranges(relayout)
+    grid, x_centers, _ = butil.raster(x, y, x_range, y_range, shape=(5, 4))
+    assert grid.sum() == 10 and x_centers[0] > pd.Timestamp("2020-01-11")
+    assert butil.relayout_ranges({"xaxis.autorange": True}) == (None, None)
+
+
+def test_aggregate_many_match_aggregate():
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2020-01-01", "2020-01-02"] * 3),
+            "state": ["Texas", "Texas", "Ohio", "Ohio", "Utah", "Utah"],
+            "cases": [1, 20, 300, 4000, 50000, 600000],
+            "deaths": [0.5, 1.5, 2.5, 3.5, 4.5, 5.5],
+        }
+    )
+    filters = butil.prepare_filters({"state_filter": ["Texas", "Ohio"]})
+    specs = [
+        {"y_column": "cases"},
+        {"y_column": ["deaths"], "logic": "mean"},
+        {"y_column": "cases", "fixed_filters": {"or": {"state": ["Utah"]}}},
+        {"keys": ["state"]},
+    ]
+    expected = [butil.aggregate(df, filters=filters, **spec) for spec in specs]
+    assert butil.aggregate_many(df, specs, filters=filters) == expected
+    assert expected[0] == (4.32, "K")
+
+
+def test_filter_logics():
+    df = pd.DataFrame(
+        {
+            "state": ["Texas", "Ohio", None, "Utah", "Ohio", "Iowa"],
+            "cases": [1, 20, 300, 4000, 50000, 600000],
+            "rate": [0.5, None, 1.5, 2.0, 2.5, 3.0],
+        }
+    )
+    inputs = {
+        "cases__between_filter": [10, 50000],
+        "state__not_in_filter": ["Utah"],
+        "rate__ne_filter": 2.5,
+    }
+    filters = butil.prepare_filters(inputs)
+    assert filters["between"]["cases"] == [10, 50000]
+    expected = df[
+        df["cases"].between(10, 50000) & ~df["state"].isin(["Utah"]) & (df.rate != 2.5)
+    ]
+    pd.testing.assert_frame_equal(butil.filter_df(df, filters), expected)
+
+    filters = {"null": {"state": []}, "gt": {"cases": [100]}}
+    pd.testing.assert_frame_equal(butil.filter_df(df, filters), df.iloc[[2]])
+    filters = {"not_null": {"rate": []}, "le": {"rate": [2.0]}, "lt": {"cases": [300]}}
+    pd.testing.assert_frame_equal(butil.filter_df(df, filters), df.iloc[[0]])
+
+
+def test_cube_keeps_grouped_columns():
+    df = pd.DataFrame(
+        {
+            "year": [2019, 2019, 2020, 2020, 2020],
+            "type": ["Oil", "Gas", "Oil", "Oil", "Gas"],
+            "latitude": [30.0, 31.0, 30.0, 32.0, 31.0],
+            "longitude": [-97.0, -98.0, -97.0, -99.0, -98.0],
+            "produced": [1, 2, 3, 4, 5],
+        }
+    )
+    data = {"df": df, "keys": ["type"]}
+    datautil.add_cube(data)
+    cube = data["cube"]
+    filters = butil.prepare_filters({"type_filter": ["Oil"]})
+    expected = butil.aggregate(df, "produced", filters, logic="max", keys=["year"])
+    actual = butil.aggregate(
+        df, "produced", filters, logic="max", keys=["year"], cube=cube
+    )
+    assert actual == expected == (7, "")
+    # The years and locations are summed in the (type,) rollup
+    assert butil.from_cube(df, cube, filters, ["year"], grouped=["year"]) is df
+    locations = ["latitude", "longitude"]
+    assert butil.from_cube(df, cube, filters, locations, grouped=locations) is df
+
+
+def test_cube_rank_text_key():
+    df = pd.DataFrame(
+        {
+            "state": ["Texas", "Texas", "Ohio", "Ohio"],
+            "county": ["a", "b", "c", "c"],
+            "cases": [1, 2, 3, 4],
+        }
+    )
+    data = {"df": df, "keys": ["state", "county"]}
+    datautil.add_cube(data)
+    expected = [("Ohio", 7), ("Texas", 2), ("Texas", 1)]
+    assert list(butil.rank(df, "county", "state", "cases")) == expected
+    ranked = butil.rank(df, "county", "state", "cases", cube=data["cube"])
+    assert list(ranked) == expected
@@ -4,7 +4,8 @@ import math
 import plotly.express as px
 
 from collections import defaultdict
-from bento.common import logger, logutil, dictutil  # noqa
+from bento.common import logger, logutil, dictutil, datautil, sqlutil  # noqa
+from bento.common import filterutil
 
 logging = logger.fancy_logger(__name__)
 
@@ -67,48 +68,322 @@ def prepare_filters(inputs):
             continue
         if not isinstance(values, list):
             values = [values]
-        if "date" in key and len(values) == 2:
+        # Other logics are named after the column, e.g. population__gt_filter
+        column, _, operator = col.partition("__")
+        if operator in filterutil.LOGICS:
+            filters[operator][column].extend(values)
+        elif "date" in key and len(values) == 2:
             filters["between"][col].extend(values)
         else:
             filters[logic][col].extend(values)
     return filters
 
 
+def from_cube(idf, cube, filters, columns, grouped=()):
+    """Swaps in the smallest rollup of a cube able to stand in for the data
+
+    This is only valid for callers that sum the numeric columns after filtering,
+    and grouping by the grouped columns (see datautil.Cube).
+    """
+    if cube is None:
+        return idf
+    # NOTE Callers must drop any InvertedIndex of idf when a rollup is used
+    # Filtering or grouping on a summed column wouldn't give the same rows
+    filtered = {column for columns in filters.values() for column in columns}
+    rollup = cube.lookup(columns, grouped=filtered | set(grouped))
+    return idf if rollup is None else rollup
+
+
+def _sorted_slice(idf, column, values):
+    """Selects the rows between the values by binary search, if column is sorted
+
+    Data loaded with a sort column (see datautil.df_loader) is marked as sorted in
+    its attrs, so the matching rows are a contiguous slice. Returns None otherwise.
+    """
+    bounds = _sorted_bounds(idf, column, values)
+    if bounds is None:
+        return None
+    return idf.iloc[bounds[0] : bounds[1]]
+
+
+def _sorted_bounds(idf, column, values):
+    """The start and stop positions of _sorted_slice, or None"""
+    if idf.attrs.get("sorted") != column:
+        return None
+    series = idf[column]
+    bounds = values[:2]
+    # Date sliders give their bounds as integer nanoseconds
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        try:
+            bounds = [np.datetime64(pd.Timestamp(value), "ns") for value in bounds]
+        except (TypeError, ValueError):
+            return None
+    array = series.to_numpy()
+    try:
+        start = np.searchsorted(array, bounds[0], side="left")
+        stop = np.searchsorted(array, bounds[1], side="right")
+    except TypeError:
+        return None
+    return start, stop
+
+
+def _between(idf, column, values):
+    """Selects the rows with column between the values, inclusive"""
+    sliced = _sorted_slice(idf, column, values)
+    if sliced is not None:
+        return sliced
+    # TODO generalize filters to handle types
+    try:
+        return idf[(idf[column] >= values[0]) & (idf[column] <= values[1])]
+    except TypeError:
+        return idf[
+            (idf[column].astype(int) >= values[0])
+            & (idf[column].astype(int) <= values[1])  # noqa
+        ]
+
+
+def _usable_index(idf, index):
+    """Whether an InvertedIndex can locate rows in idf (see datautil.add_index)"""
+    return (
+        index is not None
+        and isinstance(idf, pd.DataFrame)
+        and index.rows == len(idf)
+    )
+
+
 # NOTE Currently used for pie charts and ranking
 # @logutil.loginfo(level='debug')
-def filter_df(idf, filters):
-    odf = idf
-    for logic, columns in filters.items():
-        for column, values in columns.items():
-            if "datetime" in str(type(values[0])):
-                values = [np.datetime64(item) for item in values]
-            if logic == "between":
-                # TODO generalize filters to handle types
-                try:
-                    odf = odf[(odf[column] >= values[0]) & (odf[column] <= values[1])]
-                except TypeError:
-                    odf = odf[
-                        (odf[column].astype(int) >= values[0])
-                        & (odf[column].astype(int) <= values[1])  # noqa
-                    ]
-            elif logic == "or":
-                odf = odf[odf[column].isin(values)]
-            elif logic == "and":
-                odf = odf[odf[column].isin(values)]
-
-    return odf
+def filter_df(idf, filters, index=None, cache=None):
+    # Callbacks fired together share their filtered rows (see datautil.FrameCache)
+    if cache is not None and filters:
+        key = ("rows", id(idf), filterutil.filters_key(filters))
+        return cache.get(key, lambda: filter_df(idf, filters, index=index))
+    # Out-of-core data is filtered one partition at a time
+    if isinstance(idf, datautil.Partitions):
+        return pd.concat([filter_df(part, filters) for part in idf])
+    # A database table runs the filters itself
+    if isinstance(idf, sqlutil.SqlTable):
+        return idf.filtered(filters)
+
+    positions = None
+    indexed = []
+    if _usable_index(idf, index):
+        # Rows matching the indexed columns are located up front
+        indexed = [
+            (logic, column)
+            for logic, columns in filters.items()
+            if logic in filterutil.SELECTIONS
+            for column in columns
+            if column in index.positions
+        ]
+        if indexed:
+            selections = [(column, filters[logic][column]) for logic, column in indexed]
+            positions = index.select(selections)
+    conditions = filterutil.compile_filters(
+        {
+            logic: {
+                column: values
+                for column, values in columns.items()
+                if (logic, column) not in indexed
+            }
+            for logic, columns in filters.items()
+        }
+    )
+    return _select(idf, conditions, positions)
+
+
+def _select(idf, conditions, positions=None):
+    """Takes the rows of idf meeting the conditions (see filterutil.compile_filters)
+
+    When positions are given, only the rows at those (sorted) positions are
+    considered. A range of the sorted column narrows the rows by binary search,
+    then the other conditions are evaluated as one mask, so the rows are gathered
+    with a single take rather than a copy of the frame for each condition.
+    """
+    conditions = list(conditions)
+    bounds = None
+    for idx, (column, logic, values) in enumerate(conditions):
+        if logic == "between":
+            bounds = _sorted_bounds(idf, column, values)
+            if bounds is not None:
+                del conditions[idx]
+                break
+
+    if bounds is not None:
+        start, stop = bounds
+        if positions is None and not conditions:
+            return idf.iloc[start:stop]
+        if positions is None:
+            positions = np.arange(start, stop)
+        else:
+            start, stop = np.searchsorted(positions, bounds)
+            positions = positions[start:stop]
+    if conditions:
+        mask = filterutil.filter_mask(idf, conditions, positions)
+        positions = np.flatnonzero(mask) if positions is None else positions[mask]
+    if positions is None:
+        return idf
+    return idf.take(positions)
 
 
 # @logutil.loginfo(level="debug")
 # TODO Figure out a way around this hack, which manually filters out None strings as
 # a substitute for properly dealing with bipartite dataframes
-def rank(idf, key, text_key, column, count=10, **kwargs):
-    fdf = idf.groupby(key).sum().reset_index()
+def rank(
+    idf,
+    key,
+    text_key,
+    column,
+    count=10,
+    filters=None,
+    cube=None,
+    index=None,
+    totals=None,
+    cache=None,
+    **kwargs,
+):
+    filters = filters or {}
+    keys = key if isinstance(key, list) else [key]
+    columns = list(dict.fromkeys(keys + [text_key, column]))
+    fdf = from_cube(idf, cube, filters, columns, grouped=keys)
+    if fdf is not idf:
+        idf, index, totals, cache = fdf, None, None, None
+    if totals is not None and totals.rows == len(idf):
+        ranked = _ranked_totals(
+            idf, keys, text_key, column, count, filters, index, totals
+        )
+        if ranked is not None:
+            return ranked
+    if isinstance(idf, sqlutil.SqlTable):
+        return idf.rank(key, text_key, column, count=count, filters=filters)
+    if isinstance(idf, datautil.Partitions):
+        # Sum each partition's groups, then combine the partial sums
+        partials = [
+            _sum_groups(
+                filter_df(part, filters).groupby(key, observed=True), keys, text_key
+            )
+            for part in idf
+        ]
+        grouped = pd.concat(partials).groupby(level=key)
+        fdf = _sum_groups(grouped, keys, text_key).reset_index()
+    else:
+        fdf = filter_df(idf, filters, index=index, cache=cache)
+        grouped = fdf.groupby(key, observed=True)
+        fdf = _sum_groups(grouped, keys, text_key).reset_index()
     fdf = fdf[fdf[text_key] != "None"]
     fdf = fdf.nlargest(count, column)
     return zip(fdf[text_key], fdf[column])
 
 
+def _sum_groups(grouped, keys, text_key):
+    """The sums of the groups, with the text_key of their first row if not a key"""
+    sums = grouped.sum()
+    if text_key not in keys:
+        sums[text_key] = grouped[text_key].first()
+    return sums
+
+
+def _split_filters(filters):
+    """Splits off the or/and filter with the most values, as (logic, column, values)
+
+    Rows passing the filters are those passing the rest of them with any one of
+    those values, so the totals over each value add up to the totals overall.
+    """
+    split = None
+    rest = {logic: dict(columns) for logic, columns in filters.items()}
+    for logic, columns in rest.items():
+        if logic not in ("or", "and"):
+            continue
+        for column, values in columns.items():
+            if split is None or len(values) > len(split[2]):
+                split = (logic, column, values)
+    if split is None:
+        return None, rest
+    logic, column, values = split
+    del rest[logic][column]
+    return (logic, column, list(dict.fromkeys(values))), rest
+
+
+def _row_positions(idf, fdf):
+    """Positions in idf of the rows of fdf, which was filtered from it"""
+    labels = idf.index
+    if isinstance(labels, pd.RangeIndex) and labels.start == 0 and labels.step == 1:
+        return fdf.index.to_numpy()
+    if not labels.is_unique:
+        return None
+    return labels.get_indexer(fdf.index)
+
+
+def _ranked_totals(idf, keys, text_key, column, count, filters, index, totals):
+    """The top groups of rank, from the group totals of a datautil.GroupTotals
+
+    The totals of the rows with each value of the split filter (see _split_filters)
+    are kept, and those still missing are tallied together, from one filtered
+    pass. Returns None when the totals can't stand in for a groupby.
+    """
+    dtype = idf[column].dtype
+    if text_key not in keys or not isinstance(dtype, np.dtype):
+        return None
+    if dtype.kind not in "iuf":
+        return None
+    split, rest = _split_filters(filters)
+    selection = (tuple(keys), column, repr(rest))
+    if split is None:
+        logic, split_column, values = None, None, [None]
+    else:
+        logic, split_column, values = split
+
+    tallies = {value: totals.get(selection + (value,)) for value in values}
+    missing = [value for value, tally in tallies.items() if tally is None]
+    if missing:
+        missing_filters = dict(rest)
+        if split is not None:
+            missing_filters[logic] = {**rest.get(logic, {}), split_column: missing}
+        fdf = filter_df(idf, missing_filters, index=index)
+        positions = _row_positions(idf, fdf)
+        if positions is None:
+            return None
+        labels = None
+        if split is not None:
+            labels = pd.Index(missing).get_indexer(fdf[split_column].to_numpy())
+            # Values only matching after a conversion can't be told apart here
+            if (labels < 0).any():
+                return None
+        new = totals.tally(idf, keys, column, positions, labels, len(missing))
+        for value, tally in zip(missing, new):
+            tallies[value] = tally
+            totals.put(selection + (value,), tally)
+
+    _, groups = totals.grouping(idf, keys)
+    sums, counts = sum(tallies.values())
+    if dtype.kind in "iu":
+        sums = np.round(sums).astype(np.int64)
+    else:
+        sums = sums.astype(dtype)
+    eligible = (counts > 0) & (groups[text_key] != "None").to_numpy()
+    top = _top_positions(sums, eligible, count)
+    return zip(groups[text_key].to_numpy()[top].tolist(), sums[top].tolist())
+
+
+def _top_positions(values, eligible, count):
+    """Positions of the count largest eligible values, largest first
+
+    Like DataFrame.nlargest, ties keep the earlier positions, but only a partial
+    selection is made, rather than sorting all of the values.
+    """
+    candidates = np.flatnonzero(eligible)
+    if count <= 0:
+        return candidates[:0]
+    values = values[candidates]
+    if count < len(candidates):
+        kth = np.partition(values, len(values) - count)[len(values) - count]
+        above = np.flatnonzero(values > kth)
+        ties = np.flatnonzero(values == kth)[: count - len(above)]
+        keep = np.sort(np.concatenate([above, ties]))
+        candidates, values = candidates[keep], values[keep]
+    return candidates[np.lexsort((candidates, -values))]
+
+
 def apply_defaults(component_type, raw_inputs, data):
     inputs = {"variant": component_type.split(".")[-1]}
     inputs.update(raw_inputs)
@@ -139,7 +414,33 @@ def apply_defaults(component_type, raw_inputs, data):
 # NOTE Used for preparing the traces for graphs
 # TODO Should combine this with filter_df/
 # @logutil.loginfo(level="debug")
-def prepare_traces(idf, filters, key_columns):
+def prepare_traces(idf, filters, key_columns, index=None, cache=None):
+    if cache is not None:
+        keys = tuple(key_columns or ())
+        # The traces follow the order of the filters, so it's part of the key
+        key = ("traces", id(idf), filterutil.filters_key(filters, ordered=True), keys)
+        traces = cache.get(
+            key, lambda: prepare_traces(idf, filters, key_columns, index=index)
+        )
+        # Each caller gets frames of its own, sharing the cached data
+        copies = []
+        for trace in traces:
+            copies.append(trace.copy(deep=False))
+            copies[-1].name = trace.name
+        return copies
+    if isinstance(idf, datautil.Partitions):
+        return _partitioned_traces(idf, filters, key_columns)
+    if isinstance(idf, sqlutil.SqlTable):
+        return idf.traces(filters, key_columns)
+    # Comparing dates to selected values relies on pandas parsing them
+    selected = [col for logic in ("or", "and") for col in filters.get(logic, {})]
+    if any(pd.api.types.is_datetime64_any_dtype(idf[col]) for col in selected):
+        return _sliced_traces(idf, filters, key_columns)
+    return _split_traces(idf, filters, key_columns, index=index)
+
+
+def _sliced_traces(idf, filters, key_columns):
+    """Prepares the traces by slicing the frame for each selected value"""
     # NOTE Brought over from figure callback, default multi-column approach
     # TODO Figure out how to determine default columns from df
     # column = self.data.get("keys", self.data["columns"][0])[0]
@@ -153,14 +454,7 @@ def prepare_traces(idf, filters, key_columns):
         if logic == "between":
             for column, values in columns.items():
                 for df in traces:
-                    # TODO generalize filters to handle types
-                    try:
-                        new = df[(df[column] >= values[0]) & (df[column] <= values[1])]
-                    except TypeError:
-                        new = df[
-                            (df[column].astype(int) >= values[0])
-                            & (df[column].astype(int) <= values[1])  # noqa
-                        ]
+                    new = _between(df, column, values)
                     new.name = df.name
                     new_traces.append(new)
         elif logic == "or":
@@ -191,13 +485,20 @@ def prepare_traces(idf, filters, key_columns):
                             # except Exception:
                             #     logging.warning(f"Can't add {column} to trace name")
                         new_traces.append(new)
+        else:
+            for column, values in columns.items():
+                condition = filterutil.compile_condition(column, logic, values)
+                for df in traces:
+                    new = _select(df, [condition])
+                    new.name = df.name
+                    new_traces.append(new)
 
         traces = new_traces
 
     new_traces = []
     if key_columns:
         for df in traces:
-            new = df.groupby(key_columns).sum().reset_index()
+            new = df.groupby(key_columns, observed=True).sum().reset_index()
             new.name = df.name
             new_traces.append(new)
     else:
@@ -207,8 +508,234 @@ def prepare_traces(idf, filters, key_columns):
     return traces
 
 
+def _trace_ids(idf, columns, values):
+    """Numbers the rows of idf by which of the values (tuples) they hold, else -1"""
+    if len(columns) > 1:
+        lookup = pd.MultiIndex.from_tuples(values)
+        return lookup.get_indexer(pd.MultiIndex.from_frame(idf[columns]))
+    lookup = pd.Index([value for (value,) in values])
+    series = idf[columns[0]]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Only the categories need looking up, rather than every row
+        ids = np.append(lookup.get_indexer(series.cat.categories), -1)
+        return ids[series.cat.codes.to_numpy()]
+    return lookup.get_indexer(series)
+
+
+def _split_traces(idf, filters, key_columns, index=None):
+    """Prepares the traces with one pass over the rows for each set of columns
+
+    Traces selecting values of the same columns (under the same ranges) hold
+    different rows, so the rows are labelled with their trace and all of those
+    traces are grouped and summed together, rather than slicing the frame and
+    grouping once per trace. The traces and their names are the same as
+    slicing would give. An InvertedIndex (see datautil) narrows down the rows.
+    """
+    idf["label"] = ""
+    idf.name = ""
+    specs = sqlutil.trace_specs(filters)
+
+    # Traces differing only in their selected values share a shape
+    shapes = defaultdict(list)
+    for idx, (_, conditions) in enumerate(specs):
+        shape = tuple(
+            (column, operator, None if operator == "=" else tuple(value))
+            for column, operator, value in conditions
+        )
+        shapes[shape].append(idx)
+
+    traces = [None] * len(specs)
+    for shape, members in shapes.items():
+        columns = [column for column, operator, _ in shape if operator == "="]
+        selected = [
+            tuple(value for _, operator, value in specs[idx][1] if operator == "=")
+            for idx in members
+        ]
+        values = list(dict.fromkeys(selected))
+        trace_ids = {row: trace_id for trace_id, row in enumerate(values)}
+
+        positions = None
+        if _usable_index(idf, index):
+            selections = [
+                (column, list({row[pos] for row in values}))
+                for pos, column in enumerate(columns)
+                if column in index.positions
+            ]
+            if selections:
+                positions = index.select(selections)
+        conditions = [
+            filterutil.compile_condition(column, operator, value)
+            for column, operator, value in shape
+            if operator != "="
+        ]
+        df = _select(idf, conditions, positions)
+
+        ids = np.zeros(len(df), dtype=int)
+        if columns:
+            ids = _trace_ids(df, columns, values)
+            df, ids = df[ids >= 0], ids[ids >= 0]
+
+        if key_columns:
+            grouped = df.groupby([ids] + list(key_columns), observed=True).sum()
+            parts = {
+                trace_id: part.droplevel(0).reset_index()
+                for trace_id, part in grouped.groupby(level=0)
+            }
+            empty = grouped.iloc[:0].droplevel(0).reset_index()
+        else:
+            parts = dict(iter(df.groupby(ids))) if columns else {0: df}
+            empty = df.iloc[:0]
+
+        seen = set()
+        for idx, row in zip(members, selected):
+            trace = parts.get(trace_ids[row], empty)
+            # Traces are changed in place later on, so none may be shared
+            if trace is empty or row in seen:
+                trace = trace.copy()
+            seen.add(row)
+            trace.name = specs[idx][0]
+            traces[idx] = trace
+    return traces
+
+
+def _partitioned_traces(parts, filters, key_columns):
+    """Prepares the traces of each partition and combines them"""
+    partials = [prepare_traces(part, filters, key_columns) for part in parts]
+    traces = []
+    # Each partition yields the same list of traces, in the same order
+    for trace_parts in zip(*partials):
+        new = pd.concat(trace_parts)
+        if key_columns:
+            new = new.groupby(key_columns, observed=True).sum().reset_index()
+        new.name = trace_parts[0].name
+        traces.append(new)
+    return traces
+
+
+# Operations of prepare_transforms that trace_analytics runs across all traces
+WIDE_OPERATIONS = {"rolling", "mean", "diff", "cumsum", "div"}
+
+
 # @logutil.loginfo(level="debug")
 def trace_analytics(traces, transforms):
+    """Applies the transforms from prepare_transforms to each trace
+
+    Each transformed column of the traces is laid out as one wide frame, with a
+    column per trace, so every step of a transform runs once over all the traces
+    rather than once per trace. The traces are returned as new frames, leaving
+    those passed in (which may be views of the data) unchanged.
+    """
+    traces = list(traces)
+    grids = {}
+    for column, operations, arg_list in transforms:
+        if column not in grids:
+            grids[column] = _wide_frame(traces, column)
+        if grids[column] is None:
+            return _looped_analytics(traces, transforms)
+        wide, lengths = grids[column]
+        wide = _wide_transform(wide, lengths, traces, operations, arg_list)
+        if wide is None:
+            return _looped_analytics(traces, transforms)
+        grids[column] = (wide, lengths)
+
+    values = {column: wide.to_numpy() for column, (wide, _) in grids.items()}
+    new_traces = []
+    for idx, trace in enumerate(traces):
+        new = trace.copy(deep=False)
+        for column, (_, lengths) in grids.items():
+            new[column] = values[column][: lengths[idx], idx]
+        new.name = getattr(trace, "name", "")
+        new_traces.append(new)
+    return new_traces
+
+
+def _wide_frame(traces, column):
+    """Lays out the column of each trace as a column of one frame
+
+    The traces are padded at the end to the same length. Returns the frame with
+    the length of each trace, or None if the traces can't share a numeric dtype.
+    """
+    series_list = [trace[column] for trace in traces]
+    if not series_list or len({series.dtype for series in series_list}) > 1:
+        return None
+    dtype = series_list[0].dtype
+    if not isinstance(dtype, np.dtype) or dtype.kind not in "iuf":
+        return None
+    lengths = np.array([len(series) for series in series_list])
+    valid = np.arange(lengths.max())[None, :] < lengths[:, None]
+    grid = np.zeros(valid.shape, dtype=dtype)
+    grid[valid] = np.concatenate([series.to_numpy() for series in series_list])
+    return pd.DataFrame(grid.T), lengths
+
+
+def _wide_transform(wide, lengths, traces, operations, arg_list):
+    """Runs one transform over the wide frame of _wide_frame
+
+    Every operation only looks back along a column (or at the column's own rows),
+    so the padding never changes the results, which are those of transforming
+    each Series. Returns None for anything else, leaving it to the loop.
+    """
+    if not WIDE_OPERATIONS.issuperset(operations):
+        return None
+    refs = [arg for args in arg_list for arg in args if "ref" in str(arg)]
+    # The reference trace is read as it stands, so only a lone op is equivalent
+    if refs and len(operations) > 1:
+        return None
+
+    valid = np.arange(len(wide))[:, None] < lengths[None, :]
+    window = None
+    for op, args in zip(operations, arg_list):
+        if op == "rolling":
+            window = args
+            continue
+        final_args = []
+        for arg in args:
+            if "trace" in str(arg):
+                oper = arg.split(".")[-1]
+                final_args.append(getattr(wide.where(valid), oper)())
+            elif "ref" in str(arg):
+                reference = _reference_frame(wide, lengths, traces)
+                if reference is None:
+                    return None
+                final_args.append(reference)
+            else:
+                final_args.append(arg)
+        if window is not None:
+            wide = getattr(wide.rolling(*window), op)(*final_args)
+            window = None
+        else:
+            wide = getattr(wide, op)(*final_args)
+    if window is not None:
+        return None
+    return wide
+
+
+def _reference_frame(wide, lengths, traces):
+    """The divisors of normalizing to the first trace, laid out like the traces
+
+    The first trace is divided by itself. By the time the following traces are
+    divided, the first has been replaced by that ratio, so they are divided by
+    it instead (aligned on the index, as Series.div does).
+    """
+    index = traces[0].index
+    if not index.is_unique:
+        return None
+    first = pd.Series(wide[0].to_numpy()[: lengths[0]], index=index)
+    ratio = first.div(first)
+    grid = np.full(wide.shape, np.nan)
+    grid[: lengths[0], 0] = first.to_numpy()
+    for idx, trace in enumerate(traces[1:], 1):
+        grid[: lengths[idx], idx] = ratio.reindex(trace.index).to_numpy()
+    return pd.DataFrame(grid)
+
+
+def _looped_analytics(traces, transforms):
+    """Applies the transforms to one trace at a time"""
+    copies = []
+    for trace in traces:
+        copies.append(trace.copy())
+        copies[-1].name = getattr(trace, "name", "")
+    traces = copies
     for transform in transforms:
         column, operations, arg_list = transform
         for trace in traces:
@@ -229,22 +756,214 @@ def trace_analytics(traces, transforms):
     return traces
 
 
+def downsample(x, y, max_points):
+    """Positions of up to max_points rows that keep the shape of a trace
+
+    Uses Largest-Triangle-Three-Buckets: the first and last rows are kept, the rows
+    between are split into buckets, and each bucket keeps the row making the largest
+    triangle with the row kept before it and the average of the next bucket. Peaks
+    and troughs survive, where striding would skip them. When x isn't in order, the
+    rows are strided instead. Returns None when the trace already fits.
+    """
+    rows = len(y)
+    if not max_points or rows <= max(max_points, 2):
+        return None
+    if max_points < 3:
+        return np.linspace(0, rows - 1, max_points).astype(int)
+    x = _numeric_values(x)
+    if x is None or not (np.diff(x) >= 0).all():
+        return np.linspace(0, rows - 1, max_points).astype(int)
+    y = np.nan_to_num(_numeric_values(y))
+
+    # Buckets of the rows between the first and last, with the averages of each
+    edges = np.linspace(1, rows - 1, max_points - 1).astype(int)
+    counts = np.diff(edges)
+    x_means = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    y_means = np.add.reduceat(y[:-1], edges[:-1]) / counts
+
+    positions = np.empty(max_points, dtype=int)
+    positions[0], positions[-1] = 0, rows - 1
+    ax, ay = x[0], y[0]
+    for idx in range(max_points - 2):
+        start, stop = edges[idx], edges[idx + 1]
+        if idx + 1 < max_points - 2:
+            cx, cy = x_means[idx + 1], y_means[idx + 1]
+        else:
+            cx, cy = x[-1], y[-1]
+        bx, by = x[start:stop], y[start:stop]
+        areas = np.abs((ax - cx) * (by - ay) - (ax - bx) * (cy - ay))
+        best = start + int(areas.argmax())
+        positions[idx + 1] = best
+        ax, ay = x[best], y[best]
+    return positions
+
+
+def raster(x, y, x_range=None, y_range=None, shape=(300, 400), weights=None):
+    """Bins points into a grid of shape (rows of y, columns of x), for any number
+
+    Each cell holds the count of the points in it, or the sum of their weights.
+    The grid covers the given ranges, e.g. those zoomed to (see relayout_ranges),
+    or else all the points. Returns the grid with the centers of its columns and
+    rows, as dates where x or y are dates.
+    """
+    axes = []
+    for values, value_range, bins in ((x, x_range, shape[1]), (y, y_range, shape[0])):
+        numeric = _numeric_values(values)
+        if numeric is None:
+            raise ValueError(f"Can't raster {values.name}, only numbers and dates")
+        axes.append((numeric, _raster_bounds(numeric, value_range, values), bins))
+
+    # The cell of each point, leaving out those beyond the ranges (or missing)
+    inside = np.ones(len(axes[0][0]), dtype=bool)
+    positions = []
+    for numeric, (low, high), bins in axes:
+        inside &= (numeric >= low) & (numeric <= high)
+        positions.append(np.minimum((numeric - low) * bins / (high - low), bins - 1))
+    columns, rows = (position[inside].astype(int) for position in positions)
+    cells = rows * shape[1] + columns
+    if weights is not None:
+        weights = np.nan_to_num(_numeric_values(weights)[inside])
+    grid = np.bincount(cells, weights=weights, minlength=shape[0] * shape[1])
+    grid = grid.reshape(shape).astype(float)
+
+    centers = []
+    for values, (numeric, (low, high), bins) in zip((x, y), axes):
+        edges = np.linspace(low, high, bins + 1)
+        middle = (edges[:-1] + edges[1:]) / 2
+        if np.asarray(values).dtype.kind == "M":
+            middle = pd.to_datetime(middle.astype("int64"))
+        centers.append(middle)
+    return grid, centers[0], centers[1]
+
+
+def _raster_bounds(numeric, value_range, values):
+    """The low and high bounds of one axis of a raster"""
+    if value_range is not None:
+        if np.asarray(values).dtype.kind == "M":
+            low, high = (pd.Timestamp(item).value for item in value_range)
+        else:
+            low, high = (float(item) for item in value_range)
+    elif np.isfinite(numeric).any():
+        low, high = np.nanmin(numeric), np.nanmax(numeric)
+    else:
+        low, high = 0.0, 1.0
+    low, high = float(min(low, high)), float(max(low, high))
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    return low, high
+
+
+def relayout_ranges(relayout):
+    """The x and y ranges zoomed to, from the relayoutData of a graph
+
+    Each is a (low, high) pair, or None when the axis isn't zoomed in.
+    """
+    relayout = relayout or {}
+    ranges = []
+    for axis in ("xaxis", "yaxis"):
+        if f"{axis}.range[0]" in relayout:
+            ranges.append((relayout[f"{axis}.range[0]"], relayout[f"{axis}.range[1]"]))
+        elif f"{axis}.range" in relayout:
+            ranges.append(tuple(relayout[f"{axis}.range"]))
+        else:
+            ranges.append(None)
+    return ranges[0], ranges[1]
+
+
+def map_bounds(relayout):
+    """The longitude and latitude ranges shown by a map, from its relayoutData"""
+    corners = ((relayout or {}).get("mapbox._derived") or {}).get("coordinates")
+    if not corners:
+        return None, None
+    lons, lats = zip(*corners)
+    return (min(lons), max(lons)), (min(lats), max(lats))
+
+
+def _numeric_values(series):
+    """The values of a Series as floats, dates as nanoseconds, or None if neither"""
+    values = np.asarray(series)
+    if values.dtype.kind == "M":
+        return np.where(np.isnat(values), np.nan, values.view("int64").astype(float))
+    if values.dtype.kind in "iufb":
+        return values.astype(float)
+    return None
+
+
 # @logutil.loginfo(level="debug")
-def aggregate(idf, y_column=None, filters=None, logic="sum", keys=None, **kwargs):
+def aggregate(
+    idf,
+    y_column=None,
+    filters=None,
+    logic="sum",
+    keys=None,
+    cube=None,
+    index=None,
+    cache=None,
+    **kwargs,
+):
+    spec = {"y_column": y_column, "logic": logic, "keys": keys, **kwargs}
+    return aggregate_many(
+        idf, [spec], filters=filters, cube=cube, index=index, cache=cache
+    )[0]
+
+
+# @logutil.loginfo(level="debug")
+def aggregate_many(idf, specs, filters=None, cube=None, index=None, cache=None):
+    """Evaluates several aggregations at once, each as aggregate would
+
+    Each spec holds the arguments of one aggregation: y_column, logic, keys and
+    fixed_filters. Aggregations with the same filters and keys reduce the same
+    traces, so each distinct selection is filtered and grouped only once.
+    Returns the (quantity, scale) of each spec, in order.
+    """
     filters = filters or {}
-    filters.update(kwargs.get("fixed_filters", {}))
-    # TODO Plenty of work to do cleaning up the data processing utilities like this
-    keys = keys or ["date"]
-    traces = prepare_traces(idf, filters, keys)
-    agg_df = pd.concat(traces)
+    selections = {}
+    for idx, spec in enumerate(specs):
+        spec_filters = dict(filters)
+        spec_filters.update(spec.get("fixed_filters", {}))
+        # TODO Plenty of work to do cleaning up the data processing utilities
+        keys = spec.get("keys") or ["date"]
+        y_column = spec.get("y_column")
+        if isinstance(y_column, list):
+            y_column = y_column[0] if y_column else None
+        reduction = (idx, y_column, spec.get("logic", "sum"))
+
+        frozen = {logic: dict(cols) for logic, cols in spec_filters.items()}
+        selection = repr((keys, frozen))
+        if selection not in selections:
+            selections[selection] = (spec_filters, keys, [])
+        selections[selection][2].append(reduction)
+
+    results = [None] * len(specs)
+    for spec_filters, keys, reductions in selections.values():
+        y_columns = [y_column for _, y_column, _ in reductions if y_column]
+        columns = keys + list(dict.fromkeys(y_columns))
+        fdf = from_cube(idf, cube, spec_filters, columns, grouped=keys)
+        fdf_index, fdf_cache = (index, cache) if fdf is idf else (None, None)
+        if isinstance(fdf, sqlutil.SqlTable):
+            # The reductions run in the database when they have an SQL equivalent
+            quantities = fdf.aggregate_many(
+                [(y_column, logic) for _, y_column, logic in reductions],
+                spec_filters,
+                keys,
+            )
+            if quantities is not None:
+                for (idx, y_column, _), quantity in zip(reductions, quantities):
+                    results[idx] = get_unit(quantity) if y_column else (quantity, "")
+                continue
+        traces = prepare_traces(
+            fdf, spec_filters, keys, index=fdf_index, cache=fdf_cache
+        )
+        agg_df = pd.concat(traces)
 
-    # NOTE Pay attention to this block for multi-axis support
-    if not y_column:
-        return len(agg_df), ""
-    elif isinstance(y_column, list):
-        y_column = y_column[0]
-    quantity = getattr(agg_df[y_column], logic)()
-    return get_unit(quantity)
+        # NOTE Pay attention to this block for multi-axis support
+        for idx, y_column, logic in reductions:
+            if not y_column:
+                results[idx] = (len(agg_df), "")
+                continue
+            quantity = getattr(agg_df[y_column], logic)()
+            results[idx] = get_unit(quantity)
+    return results
 
 
 def _date_marks(ordered):
@@ -304,7 +1023,7 @@ def log_color_scale(name, base=2.718, category="sequential"):
     color_category = getattr(px.colors, category)
     color_sequence = getattr(color_category, name)
     # print(color_sequence)
-    log_val = [round(1 / base ** idx, 10) for idx in range(len(color_sequence))][::-1]
+    log_val = [round(1 / base**idx, 10) for idx in range(len(color_sequence))][::-1]
     log_val[0] = 0
     log_sequence = list(zip(log_val, color_sequence))
     return log_sequence
@@ -334,5 +1053,5 @@ if __name__ == "__main__":
 
     for i in range(-18, 19):
         unit = "Hz"
-        sig, scale = get_unit(10 ** i)
+        sig, scale = get_unit(10**i)
         print(f"{sig} {scale}{unit}")